@@ -0,0 +1,366 @@
+"""
+Aggregate ANS task results files into one columnar dataset.
+
+Each `<id>_<timestamp>_results.json` file written by `ans_task.py` is
+streamed into a `trials` table with typed columns, one row per trial, joined
+with the display metrics of the stimuli file by type and uid, and a `sessions` table,
+one row per results file. The task source code embedded in every results file
+is stored once per distinct sha1 hash. Running the aggregation again on the
+same output only appends the sessions that are not already in it.
+
+    python aggregate_ans_results.py *_results.json -o study.h5
+    python aggregate_ans_results.py *_results.json -o study_parquet --format parquet
+"""
+
+import glob
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from qa_ans_stimuli import load_stimuli, dot_arrays, blob_arrays
+
+RESULTS_SUFFIX = '_results.json'
+
+DATETIME_FORMAT = '%m_%d_%Y_%H_%M_%S'
+
+SESSION_COLUMNS = ['session', 'participant_id', 'participant_gender', 'participant_age',
+                   'participant_handedness', 'fullscreen', 'stimuli_file', 'trial_timeout',
+                   'break_duration', 'datetime', 'response_device', 'trial_selection', 'code_hash']
+
+METRIC_COLUMNS = ['number_of_circles', 'density', 'convex_hull_proportion', 'area']
+
+# Widths reserved for string columns in HDF5 tables, which cannot grow once created.
+MIN_ITEMSIZE = dict(session=64, participant_id=32, participant_gender=24, participant_handedness=8,
+                    stimuli_file=64, response_device=16, trial_selection=16, code_hash=40, type=8, left_uid=7, right_uid=7, key_pressed=8)
+
+DATA_COLUMNS = ['session', 'participant_id', 'block', 'type']
+
+
+def session_name(filename):
+    "The session name of a results file, i.e. `<id>_<timestamp>`"
+
+    name = os.path.basename(filename)
+    if name.endswith(RESULTS_SUFFIX):
+        return name[:-len(RESULTS_SUFFIX)]
+
+    return os.path.splitext(name)[0]
+
+
+def code_hash(code):
+    return hashlib.sha1(code.encode('utf-8')).hexdigest()
+
+
+def read_results(filename):
+    """
+    Read one results file into a one row sessions frame, a trials frame and
+    the (hash, source code) of the task that wrote it.
+    """
+
+    with open(filename, 'r') as f:
+        experiment_information, *sections = json.load(f)
+
+    code = experiment_information.get('code', '')
+    session = session_name(filename)
+
+    sessions = pd.DataFrame(dict(
+        session=[session],
+        participant_id=[str(experiment_information['participant_id'])],
+        participant_gender=[str(experiment_information['participant_gender'])],
+        participant_age=np.array([experiment_information['participant_age']], dtype=np.int64),
+        participant_handedness=[str(experiment_information['participant_handedness'])],
+        fullscreen=np.array([experiment_information['fullscreen']], dtype=bool),
+        stimuli_file=[str(experiment_information['stimuli_file'])],
+        trial_timeout=np.array([experiment_information['trial_timeout']], dtype=np.float64),
+        break_duration=np.array([experiment_information['break_duration']], dtype=np.int64),
+        datetime=pd.to_datetime([experiment_information['datetime']], format=DATETIME_FORMAT),
+        response_device=[str(experiment_information.get('response_device', ''))],
+        trial_selection=[str(experiment_information.get('trial_selection', 'fixed'))],
+        code_hash=[code_hash(code)]))
+
+    columns = dict(section=[], block=[], type=[], trial=[], left_uid=[], right_uid=[],
+                   left_size=[], right_size=[], key_pressed=[], rt_time=[], rt_clock=[], rt_event=[],
+                   target_ratio=[], ratio=[], correct=[])
+
+    for k, section in enumerate(sections):
+        for trial, result in enumerate(section['results']):
+            columns['section'].append(k + 1)
+            columns['block'].append(section['block'])
+            columns['type'].append(section['type'])
+            columns['trial'].append(trial + 1)
+            columns['left_uid'].append(result['left_uid'])
+            columns['right_uid'].append(result['right_uid'])
+            columns['left_size'].append(result['left_size'])
+            columns['right_size'].append(result['right_size'])
+            columns['key_pressed'].append(result['key_pressed'] or '')
+            columns['rt_time'].append(result['rt_time'])
+            columns['rt_clock'].append(result['rt_clock'])
+            columns['rt_event'].append(result.get('rt_event'))
+            # only adaptive trial selection records these
+            columns['target_ratio'].append(result.get('target_ratio'))
+            columns['ratio'].append(result.get('ratio'))
+            columns['correct'].append(result.get('correct'))
+
+    trials = pd.DataFrame(dict(
+        section=np.array(columns['section'], dtype=np.int64),
+        block=np.array(columns['block'], dtype=np.int64),
+        type=np.array(columns['type'], dtype=object),
+        trial=np.array(columns['trial'], dtype=np.int64),
+        left_uid=np.array(columns['left_uid'], dtype=object),
+        right_uid=np.array(columns['right_uid'], dtype=object),
+        left_size=np.array(columns['left_size'], dtype=np.float64),
+        right_size=np.array(columns['right_size'], dtype=np.float64),
+        key_pressed=np.array(columns['key_pressed'], dtype=object),
+        rt_time=np.array(columns['rt_time'], dtype=np.float64),
+        rt_clock=np.array(columns['rt_clock'], dtype=np.float64),
+        rt_event=np.array(columns['rt_event'], dtype=np.float64),
+        target_ratio=np.array(columns['target_ratio'], dtype=np.float64),
+        ratio=np.array(columns['ratio'], dtype=np.float64),
+        correct=pd.array(columns['correct'], dtype='boolean')))
+
+    for column in reversed(SESSION_COLUMNS):
+        trials.insert(0, column, sessions[column].iloc[0])
+
+    return sessions, trials, (sessions['code_hash'].iloc[0], code)
+
+
+def display_metrics(blocks_stimuli):
+    "Metrics of every display of a stimuli list, with its block, type and uid"
+
+    dots, blobs = dot_arrays(blocks_stimuli), blob_arrays(blocks_stimuli)
+
+    dots = pd.DataFrame(dict(block=dots['block'] + 1, type='dots', uid=dots['uid'].astype(object),
+                             number_of_circles=dots['K'].astype(np.float64),
+                             density=dots['density'],
+                             convex_hull_proportion=dots['convex_hull_proportion'],
+                             area=np.nan))
+
+    blobs = pd.DataFrame(dict(block=blobs['block'] + 1, type='blobs', uid=blobs['uid'].astype(object),
+                              number_of_circles=np.nan, density=np.nan, convex_hull_proportion=np.nan,
+                              area=blobs['area']))
+
+    return pd.concat([dots, blobs], ignore_index=True)
+
+
+class DisplayMetrics:
+
+    """
+    Display metrics of the stimuli files named in results files, loaded once
+    per stimuli file.
+    """
+
+    def __init__(self, stimuli_dir='.'):
+
+        self.stimuli_dir = stimuli_dir
+        self._metrics = {}
+
+    def __getitem__(self, stimuli_file):
+
+        if stimuli_file not in self._metrics:
+
+            filename = os.path.join(self.stimuli_dir, stimuli_file + '.json')
+
+            if os.path.exists(filename):
+                self._metrics[stimuli_file] = display_metrics(load_stimuli(filename))
+            else:
+                warnings.warn('Stimuli file %s not found: display metrics will be missing.' % filename)
+                self._metrics[stimuli_file] = None
+
+        return self._metrics[stimuli_file]
+
+    def join(self, trials):
+        """
+        Add the left and right display metrics to the trials of one session.
+
+        The metrics are joined by type and uid only: a uid identifies its
+        display, whichever block of the file it came from.
+        """
+
+        metrics = self[trials['stimuli_file'].iloc[0]] if len(trials) else None
+
+        if metrics is None:
+            for side in ('left', 'right'):
+                for column in METRIC_COLUMNS:
+                    trials[side + '_' + column] = np.nan
+            return trials
+
+        metrics = metrics.drop(columns='block').drop_duplicates(['type', 'uid'])
+
+        for side in ('left', 'right'):
+            side_metrics = metrics.rename(columns=dict([('uid', side + '_uid')] +
+                                                       [(c, side + '_' + c) for c in METRIC_COLUMNS]))
+            trials = trials.merge(side_metrics, how='left', on=['type', side + '_uid'])
+
+        return trials
+
+
+class HDF5Store:
+
+    """
+    Aggregated results in one HDF5 file: appendable `sessions` and `trials`
+    tables, and one `sources/sha1_<hash>` node per distinct task source.
+
+    PyTables has no nullable boolean column, so `correct` is stored as a
+    float: 1.0, 0.0, or NaN for no response or fixed trial selection.
+    """
+
+    def __init__(self, filename, complevel=5, complib='blosc'):
+
+        self.store = pd.HDFStore(filename, mode='a', complevel=complevel, complib=complib)
+
+    def sessions(self):
+
+        if '/sessions' not in self.store:
+            return set()
+
+        return set(self.store.select_column('sessions', 'session'))
+
+    def has_source(self, code_hash):
+        return '/sources/sha1_' + code_hash in self.store
+
+    def write_source(self, code_hash, code):
+        self.store.put('sources/sha1_' + code_hash, pd.Series([code]), format='fixed')
+
+    def append(self, sessions, trials):
+
+        self.store.append('sessions', sessions, format='table', data_columns=['session', 'participant_id'],
+                          min_itemsize={c: MIN_ITEMSIZE[c] for c in sessions if c in MIN_ITEMSIZE})
+        trials = trials.assign(correct=trials['correct'].astype(np.float64))
+
+        self.store.append('trials', trials, format='table', data_columns=DATA_COLUMNS,
+                          min_itemsize={c: MIN_ITEMSIZE[c] for c in trials if c in MIN_ITEMSIZE})
+
+    def close(self):
+        self.store.close()
+
+
+class ParquetStore:
+
+    """
+    Aggregated results in a directory of Parquet datasets: `sessions/` and
+    `trials/` with one part file per appended batch, and `sources/` with one
+    file per distinct task source.
+    """
+
+    def __init__(self, dirname):
+
+        # checked before any directory is created
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError('Parquet output needs pyarrow (pip install pyarrow); '
+                              'use an .h5 output for HDF5 instead') from None
+
+        self.dirname = dirname
+
+        for name in ('sessions', 'trials', 'sources'):
+            os.makedirs(os.path.join(dirname, name), exist_ok=True)
+
+    def sessions(self):
+
+        parts = glob.glob(os.path.join(self.dirname, 'sessions', '*.parquet'))
+        if not parts:
+            return set()
+
+        return set(pd.read_parquet(os.path.join(self.dirname, 'sessions'), columns=['session'])['session'])
+
+    def _source_filename(self, code_hash):
+        return os.path.join(self.dirname, 'sources', code_hash + '.py')
+
+    def has_source(self, code_hash):
+        return os.path.exists(self._source_filename(code_hash))
+
+    def write_source(self, code_hash, code):
+        with open(self._source_filename(code_hash), 'w') as f:
+            f.write(code)
+
+    def append(self, sessions, trials):
+
+        part = 'part-%s.parquet' % code_hash(''.join(sessions['session']))[:16]
+
+        sessions.to_parquet(os.path.join(self.dirname, 'sessions', part), index=False)
+        trials.to_parquet(os.path.join(self.dirname, 'trials', part), index=False)
+
+    def close(self):
+        pass
+
+
+def open_store(output, format=None):
+
+    if format is None:
+        format = 'hdf5' if os.path.splitext(output)[1] in ('.h5', '.hdf5', '.hdf') else 'parquet'
+
+    if format == 'hdf5':
+        return HDF5Store(output)
+    elif format == 'parquet':
+        return ParquetStore(output)
+
+    raise ValueError('Unknown format: %s' % format)
+
+
+def aggregate(filenames, output, format=None, stimuli_dir='.', batch_size=50):
+    """
+    Stream results files into the columnar dataset `output`, skipping
+    sessions already in it. Returns the number of sessions appended.
+    """
+
+    store = open_store(output, format)
+    metrics = DisplayMetrics(stimuli_dir)
+
+    try:
+        existing = store.sessions()
+        batch, appended = [], 0
+
+        def flush():
+            if batch:
+                sessions, trials = zip(*batch)
+                store.append(pd.concat(sessions, ignore_index=True), pd.concat(trials, ignore_index=True))
+                batch.clear()
+
+        for filename in filenames:
+
+            if session_name(filename) in existing:
+                continue
+
+            sessions, trials, (source_hash, code) = read_results(filename)
+
+            if not store.has_source(source_hash):
+                store.write_source(source_hash, code)
+
+            batch.append((sessions, metrics.join(trials)))
+            existing.add(session_name(filename))
+            appended += 1
+
+            if len(batch) >= batch_size:
+                flush()
+
+        flush()
+
+    finally:
+        store.close()
+
+    return appended
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(prog='aggregate_ans_results',
+                                     description='Aggregate ANS task results files into an HDF5 file or Parquet dataset.')
+
+    parser.add_argument('filenames', nargs='+', help='The results json filenames.')
+    parser.add_argument('-o', '--output', default='ans_results.h5', required=False,
+                        help='The output HDF5 filename or Parquet directory (default: ans_results.h5).')
+    parser.add_argument('--format', choices=['hdf5', 'parquet'], default=None, required=False,
+                        help='The output format (default: hdf5 for .h5/.hdf5 outputs, else parquet).')
+    parser.add_argument('--stimuli-dir', dest='stimuli_dir', default='.', required=False,
+                        help='The directory of the stimuli json files (default: current directory).')
+
+    args = parser.parse_args()
+
+    appended = aggregate(args.filenames, args.output, format=args.format, stimuli_dir=args.stimuli_dir)
+
+    print('Appended %d new sessions to %s' % (appended, args.output))
@@ -0,0 +1,316 @@
+"""
+Adaptive trial selection for the ANS task.
+
+Instead of showing the pairs of a stimuli file in file order, an estimator
+chooses the target ratio of the next trial from the responses so far, and
+the unused pair whose ratio is closest to it is taken from a `PairIndex`
+built once over the pool of displays of the file: every pair of distinct
+displays of different numbers of circles (or areas), not only the pairs
+listed in the file. A pair is shown at most once per session, and the number
+of trials does not depend on the size of the pool.
+
+ * `Staircase` is a weighted up/down staircase on the log ratio.
+ * `BayesianRatioEstimator` keeps a grid posterior over the Weber fraction
+   and targets the ratio predicted to be answered correctly with the target
+   probability.
+
+Selection is a binary search and a few array operations on small grids, and
+is deterministic, so sessions replay exactly with scripted responses (see
+`simulate`).
+"""
+
+import warnings
+from collections import OrderedDict
+from math import erf, log, sqrt
+
+import numpy as np
+
+
+def pair_ratio(left_size, right_size):
+    "Ratio of the larger to the smaller of a pair"
+    return max(left_size, right_size) / min(left_size, right_size)
+
+
+class PairIndex(object):
+
+    """
+    Pairs sorted by ratio, with the unused ones found in near constant time.
+
+    Used pairs are skipped with left and right links to the nearest unused
+    pair, compressed as they are followed, so taking pairs never rebuilds
+    the index.
+    """
+
+    def __init__(self, ratios, pairs):
+
+        order = np.argsort(ratios, kind='stable')
+
+        self.ratios = np.asarray(ratios, dtype=np.float64)[order]
+        self.pairs = [pairs[i] for i in order]
+
+        n = len(self.pairs)
+        self._log_ratios = np.log(self.ratios)
+        self._right = list(range(n))
+        self._left = list(range(n))
+        self._unused = n
+
+    def __len__(self):
+        return self._unused
+
+    @staticmethod
+    def _find(links, i, end):
+
+        root = i
+        while root != end and links[root] != root:
+            root = links[root]
+
+        while i != end and links[i] != root:
+            links[i], i = root, links[i]
+
+        return root
+
+    def _mark_used(self, i):
+
+        n = len(self.pairs)
+
+        self._right[i] = i + 1 if i + 1 < n else n
+        self._left[i] = i - 1 if i > 0 else -1
+        self._unused -= 1
+
+    def take(self, ratio):
+        """
+        Take the unused pair with ratio closest to `ratio` (in log ratio) and
+        return it with its ratio, or None if all pairs are used.
+        """
+
+        n = len(self.pairs)
+        if self._unused == 0:
+            return None
+
+        i = int(np.searchsorted(self.ratios, ratio))
+
+        above = self._find(self._right, i, n) if i < n else n
+        below = self._find(self._left, i - 1, -1) if i > 0 else -1
+
+        if above == n or (below != -1 and
+                          log(ratio) - self._log_ratios[below] <= self._log_ratios[above] - log(ratio)):
+            chosen = below
+        else:
+            chosen = above
+
+        self._mark_used(chosen)
+
+        return self.pairs[chosen], float(self.ratios[chosen])
+
+    @classmethod
+    def from_stimuli(cls, blocks_stimuli, kind, seed=0):
+        """
+        Index the pairs of the pool of displays of `kind` ('dots' or 'blobs')
+        of a stimuli list, i.e. of the distinct displays of all its blocks,
+        as (left uid, right uid, displays) keyed by the ratio of their
+        numbers of circles or areas. Pairs of equal size are left out, and
+        the side of each display is drawn with `seed`.
+        """
+
+        size = 'number_of_circles' if kind == 'dots' else 'area'
+
+        # the pool, by uid; `displays` maps the uids of every pair, whichever block they came from
+        displays = OrderedDict()
+        for block_stimuli in blocks_stimuli:
+            block_displays = block_stimuli[kind]['displays']
+            for pair in block_stimuli[kind]['stimuli']:
+                for uid in pair:
+                    if uid not in displays:
+                        displays[uid] = block_displays[uid]
+
+        uids = list(displays)
+        sizes = np.array([displays[uid][size] for uid in uids], dtype=np.float64)
+
+        first, second = np.triu_indices(len(uids), k=1)
+        distinct = sizes[first] != sizes[second]
+        first, second = first[distinct], second[distinct]
+
+        swap = np.random.RandomState(seed).random_sample(len(first)) < 0.5
+        left, right = np.where(swap, second, first), np.where(swap, first, second)
+
+        ratios = np.maximum(sizes[first], sizes[second]) / np.minimum(sizes[first], sizes[second])
+        pairs = [(uids[i], uids[j], displays) for i, j in zip(left.tolist(), right.tolist())]
+
+        return cls(ratios, pairs)
+
+
+class Staircase(object):
+
+    """
+    Weighted up/down staircase on the log ratio.
+
+    After a correct response the log ratio steps down by `step`, after an
+    incorrect one it steps up by step * target / (1 - target), which
+    converges on the ratio answered correctly with probability `target`.
+    """
+
+    def __init__(self, start=1.5, step=0.05, target=0.75, ratio_range=(1.01, 2.0)):
+
+        self.log_ratio = log(start)
+        self.step = step
+        self.target = target
+        self.log_ratio_range = (log(ratio_range[0]), log(ratio_range[1]))
+
+    def next_ratio(self):
+        return float(np.exp(self.log_ratio))
+
+    def update(self, ratio, correct):
+
+        if correct:
+            self.log_ratio = log(ratio) - self.step
+        else:
+            self.log_ratio = log(ratio) + self.step * self.target / (1 - self.target)
+
+        self.log_ratio = min(max(self.log_ratio, self.log_ratio_range[0]), self.log_ratio_range[1])
+
+    @property
+    def estimate(self):
+        return self.next_ratio()
+
+
+class BayesianRatioEstimator(object):
+
+    """
+    Grid posterior over the Weber fraction w of the standard ANS model
+
+        P(correct | r) = lapse / 2 + (1 - lapse) * Phi((r - 1) / (w * sqrt(1 + r^2)))
+
+    for a pair of ratio r. The next ratio is the one of `ratio_grid` whose
+    posterior predictive probability correct is closest to `target`.
+    """
+
+    def __init__(self, target=0.75, lapse=0.04, weber_grid=np.geomspace(0.05, 1.0, 200),
+                 ratio_grid=np.geomspace(1.01, 2.0, 100)):
+
+        self.target = target
+        self.lapse = lapse
+        self.weber_grid = np.asarray(weber_grid, dtype=np.float64)
+        self.ratio_grid = np.asarray(ratio_grid, dtype=np.float64)
+
+        # uniform prior over log w
+        self.log_posterior = np.zeros(len(self.weber_grid))
+
+        self._grid_likelihood = np.array([self.likelihood(r) for r in self.ratio_grid]).T
+
+    def likelihood(self, ratio):
+        "Probability correct at `ratio` for every Weber fraction of the grid"
+
+        z = (ratio - 1) / (self.weber_grid * sqrt(1 + ratio**2))
+        phi = np.array([0.5 * (1 + erf(x / sqrt(2))) for x in z])
+
+        return self.lapse / 2 + (1 - self.lapse) * phi
+
+    @property
+    def posterior(self):
+        p = np.exp(self.log_posterior - self.log_posterior.max())
+        return p / p.sum()
+
+    def next_ratio(self):
+        predicted = self.posterior @ self._grid_likelihood
+        return float(self.ratio_grid[np.argmin(np.abs(predicted - self.target))])
+
+    def update(self, ratio, correct):
+        p = self.likelihood(ratio)
+        self.log_posterior += np.log(p if correct else 1 - p)
+
+    @property
+    def estimate(self):
+        "Posterior mean Weber fraction"
+        return float(self.posterior @ self.weber_grid)
+
+
+ESTIMATORS = dict(staircase=Staircase, bayesian=BayesianRatioEstimator)
+
+
+class AdaptiveSelector(object):
+
+    """
+    Choose each next pair of an index at the target ratio of an estimator,
+    and update the estimator with the response to it.
+    """
+
+    def __init__(self, index, estimator):
+
+        self.index = index
+        self.estimator = estimator
+        self.history = []
+
+    def next_pair(self):
+        "The next pair, or None if the index is used up"
+
+        target = self.estimator.next_ratio()
+        taken = self.index.take(target)
+
+        if taken is None:
+            return None
+
+        pair, ratio = taken
+        self.history.append(dict(target_ratio=target, ratio=ratio, correct=None))
+
+        return pair
+
+    def update(self, correct):
+        "Update the estimator with the response to the last pair; None (no response) is ignored"
+
+        if correct is None:
+            return
+
+        self.history[-1]['correct'] = bool(correct)
+        self.estimator.update(self.history[-1]['ratio'], correct)
+
+    @classmethod
+    def from_stimuli(cls, blocks_stimuli, kind, method='bayesian', n_trials=None, **kwargs):
+        """
+        A selector over the pool of displays of a stimuli list, warning if
+        the pool has fewer pairs than the `n_trials` of the session.
+        """
+
+        index = PairIndex.from_stimuli(blocks_stimuli, kind)
+
+        if n_trials is not None and len(index) < n_trials:
+            warnings.warn('%d %s trials requested from a pool of %d pairs' % (n_trials, kind, len(index)))
+
+        return cls(index, ESTIMATORS[method](**kwargs))
+
+
+def is_correct(key_pressed, left_size, right_size):
+    "Whether `key_pressed` picked the larger display, or None for no response"
+
+    if key_pressed not in ('left', 'right'):
+        return None
+
+    return (key_pressed == 'left') == (left_size > right_size)
+
+
+def simulate(selector, weber_fraction=0.2, n_trials=100, kind='dots', seed=None):
+    """
+    Run `selector` headless against a simulated observer with the given Weber
+    fraction, and return its history. The same seed replays the same session.
+    """
+
+    _random = np.random.RandomState(seed)
+    size = 'number_of_circles' if kind == 'dots' else 'area'
+
+    for _ in range(n_trials):
+
+        pair = selector.next_pair()
+        if pair is None:
+            warnings.warn('%d %s trials requested from %d distinct pairs'
+                          % (n_trials, kind, len(selector.history)))
+            break
+
+        left_uid, right_uid, displays = pair
+        left_size, right_size = displays[left_uid][size], displays[right_uid][size]
+
+        # the observer compares noisy sizes, with noise of sd w times the size (scalar variability)
+        noise = _random.normal(scale=weber_fraction, size=2)
+        key = 'left' if left_size * (1 + noise[0]) > right_size * (1 + noise[1]) else 'right'
+
+        selector.update(is_correct(key, left_size, right_size))
+
+    return selector.history
@@ -0,0 +1,291 @@
+"""
+Near-duplicate and uid collision detection for ANS task displays.
+
+Uniqueness of the generated displays is only enforced on their uids, the
+first 7 characters of a sha1 of their seed and parameters, so
+
+ * different seeds can give displays that look almost the same, and
+ * different displays can get the same uid, one then silently replacing
+   the other in the uid keyed displays of a stimuli file.
+
+A `DuplicateIndex` fingerprints the geometry of each display as the
+occupancy of a grid of cells over its bounding circle, and finds near
+duplicates, displays whose fingerprints differ in at most a `max_distance`
+fraction of cells, by locality-sensitive hashing: the fingerprints are
+bucketed on a few random samples of cells (bands), and only displays
+sharing a bucket are compared. Adding and querying a display costs a
+bucket lookup per band, so a whole pool or file is checked in near linear
+time.
+
+    python ans_dedup.py stimuli_4_100_1010101.json
+"""
+
+import numpy as np
+
+from ans_display_store import DisplayStore
+
+# Cells per side of the fingerprint grid over the square of the bounding circle
+RESOLUTION = 24
+
+# Largest fraction of differing cells of near duplicates. Displays whose
+# circle centres are jittered by a standard deviation of 0.01 of the bounding
+# radius differ from the original in 0.03-0.09 of the cells, while unrelated
+# displays of 40-60 circles differ in 0.38 on average and 0.27 at the closest
+# of 45000 pairs: 0.15 sits in the gap, and also catches most jitters of 0.02.
+MAX_DISTANCE = 0.15
+
+# Largest fraction of differing cells of near duplicate blobs. Blobs are
+# convex shapes covering about two thirds of the cells, so unrelated blobs
+# differ in only 0.18 on average and 0.05 at the closest of 20000 pairs, and
+# a blob shifted by 0.01 of the bounding radius in up to 0.04.
+BLOB_MAX_DISTANCE = 0.04
+
+# LSH bands, and cells sampled per band. A display differing in 0.1 of the
+# cells shares the bucket of at least one band with a probability above
+# 0.999, one at MAX_DISTANCE above 0.9, while about 0.5% of unrelated
+# displays share one and are compared.
+BANDS = 64
+BAND_BITS = 20
+
+# Circles rasterized per chunk of fingerprinting
+CHUNK_CIRCLES = 16384
+
+
+class DuplicateIndex(object):
+
+    """
+    Locality-sensitive hash index of display fingerprints.
+
+    Each display is added with its uid and a key identifying it, e.g. its
+    (seed, number of circles), so that the same display added again, as in
+    every block of a stimuli file, is neither a uid collision nor a near
+    duplicate of itself.
+    """
+
+    def __init__(self, resolution=RESOLUTION, max_distance=MAX_DISTANCE, bands=BANDS, band_bits=BAND_BITS,
+                 bounding_circle_parameters=(0.0, 0.0, 1.0), seed=0):
+
+        x, y, radius = bounding_circle_parameters
+
+        grid = (np.arange(resolution) + 0.5) / resolution * 2 - 1
+        grid_x, grid_y = np.meshgrid(grid, grid)
+        inside = grid_x**2 + grid_y**2 < 1
+
+        # the centres of the cells inside the bounding circle
+        self.cells = np.stack((x + radius * grid_x[inside], y + radius * grid_y[inside]), axis=-1)
+        self.max_distance = max_distance
+
+        _random = np.random.RandomState(seed)
+        self.positions = np.array([_random.choice(len(self.cells), band_bits, replace=False) for _ in range(bands)])
+        self._weights = np.int64(1) << np.arange(band_bits, dtype=np.int64)
+
+        self._buckets = [{} for _ in range(bands)]
+        self._fingerprints = []
+        self._uids = []
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._uids)
+
+    def fingerprints(self, circles, offsets):
+        """
+        Occupancy fingerprints of the displays whose (x, y, radius) circles
+        are `circles[offsets[i]:offsets[i + 1]]`, as in a DisplayStore, as a
+        (displays, cells) bool array: a cell is occupied if its centre lies
+        in a circle.
+        """
+
+        occupied = np.zeros((len(offsets) - 1, len(self.cells)), dtype=bool)
+        display = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+        for start in range(0, len(circles), CHUNK_CIRCLES):
+
+            chunk = circles[start:start + CHUNK_CIRCLES]
+
+            covers = ((self.cells[:, 0] - chunk[:, 0:1])**2 + (self.cells[:, 1] - chunk[:, 1:2])**2 <
+                      chunk[:, 2:3]**2)
+
+            # OR the rows of each display of the chunk, whose circles are contiguous
+            chunk_display = display[start:start + CHUNK_CIRCLES]
+            first = np.flatnonzero(np.diff(chunk_display, prepend=-1))
+            occupied[chunk_display[first]] |= np.logical_or.reduceat(covers, first, axis=0)
+
+        return occupied
+
+    def fingerprint(self, circles):
+        "Occupancy fingerprint of one display of (x, y, radius) circles"
+        return self.fingerprints(np.asarray(circles), [0, len(circles)])[0]
+
+    def polygon_fingerprint(self, vertices):
+        "Occupancy fingerprint of a convex polygon, as the blobs, with counterclockwise `vertices`"
+
+        vertices = np.asarray(vertices)
+        start, end = vertices[:-1], vertices[1:]
+
+        # a cell is inside if it is left of every edge
+        cross = ((end[:, 0] - start[:, 0]) * (self.cells[:, 1:2] - start[:, 1]) -
+                 (end[:, 1] - start[:, 1]) * (self.cells[:, 0:1] - start[:, 0]))
+
+        return np.all(cross >= 0, axis=1)
+
+    def band_keys(self, fingerprints):
+        "The bucket of every band of each of `fingerprints`, as a (fingerprints, bands) array"
+        return np.atleast_2d(fingerprints)[:, self.positions].astype(np.int64) @ self._weights
+
+    def keys(self, uid):
+        "The keys of the displays added with `uid`"
+        return sorted(self._keys.get(uid, ()))
+
+    def uid_collision(self, uid, key):
+        "Whether `uid` was added for a different display than `key`"
+        return uid in self._keys and key not in self._keys[uid]
+
+    def near_duplicates(self, uid, key, fingerprint, band_keys=None):
+        """
+        The (uid, distance) of the displays added that differ from
+        `fingerprint` in at most `max_distance` of the cells, other than
+        the display (uid, key) itself.
+        """
+
+        if band_keys is None:
+            band_keys = self.band_keys(fingerprint)[0]
+
+        candidates = set()
+        for buckets, band_key in zip(self._buckets, band_keys.tolist()):
+            candidates.update(buckets.get(band_key, ()))
+
+        duplicates = []
+        for i in sorted(candidates):
+
+            other_uid, other_key = self._uids[i]
+            if (other_uid, other_key) == (uid, key):
+                continue
+
+            distance = int(np.count_nonzero(self._fingerprints[i] != fingerprint)) / len(self.cells)
+            if distance <= self.max_distance:
+                duplicates.append((other_uid, distance))
+
+        return duplicates
+
+    def add(self, uid, key, fingerprint, band_keys=None):
+        "Add the display (uid, key), unless it was added before"
+
+        if key in self._keys.get(uid, ()):
+            return
+
+        if band_keys is None:
+            band_keys = self.band_keys(fingerprint)[0]
+
+        i = len(self._uids)
+        for buckets, band_key in zip(self._buckets, band_keys.tolist()):
+            buckets.setdefault(band_key, []).append(i)
+
+        self._fingerprints.append(fingerprint)
+        self._uids.append((uid, key))
+        self._keys.setdefault(uid, set()).add(key)
+
+
+def find_duplicates(uids, keys, fingerprints, index=None):
+    """
+    The uid collisions, as (uid, key, other key), and near duplicates, as
+    (uid, other uid, distance), among the displays with `uids`, `keys` and
+    `fingerprints`, each compared with those before it.
+    """
+
+    if index is None:
+        index = DuplicateIndex()
+
+    band_keys = index.band_keys(fingerprints)
+
+    collisions, near_duplicates = [], []
+    for uid, key, fingerprint, display_band_keys in zip(uids, keys, fingerprints, band_keys):
+
+        if index.uid_collision(uid, key):
+            collisions.extend((uid, key, other_key) for other_key in index.keys(uid))
+
+        near_duplicates.extend((uid, other_uid, distance) for other_uid, distance
+                               in index.near_duplicates(uid, key, fingerprint, display_band_keys))
+
+        index.add(uid, key, fingerprint, display_band_keys)
+
+    return dict(uid_collisions=collisions, near_duplicates=near_duplicates)
+
+
+def store_duplicates(store, **kwargs):
+    "The uid collisions and near duplicates of the displays of a DisplayStore, keyed by (seed, K)"
+
+    index = DuplicateIndex(**kwargs)
+    keys = list(zip(store.seed.tolist(), store.K.tolist()))
+
+    return find_duplicates(store.uid.tolist(), keys, index.fingerprints(store.circles, store.offsets), index)
+
+
+def stimuli_duplicates(blocks_stimuli, kinds=('dots', 'blobs'), max_distance=None, **kwargs):
+    """
+    The uid collisions and near duplicates of the dots and blobs displays
+    across all the blocks of a stimuli list. Dots are keyed by (seed, K),
+    blobs by their vertices. `max_distance` defaults to MAX_DISTANCE for
+    dots and BLOB_MAX_DISTANCE for blobs.
+    """
+
+    max_distances = dict(dots=MAX_DISTANCE, blobs=BLOB_MAX_DISTANCE)
+
+    report = {}
+    for kind in kinds:
+
+        index = DuplicateIndex(max_distance=max_distance or max_distances[kind], **kwargs)
+        uids, keys, fingerprints = [], [], []
+
+        for block_stimuli in blocks_stimuli:
+
+            displays = block_stimuli[kind]['displays']
+
+            if kind == 'dots':
+                store = DisplayStore.from_displays(displays)
+                uids.extend(store.uid.tolist())
+                keys.extend(zip(store.seed.tolist(), store.K.tolist()))
+                fingerprints.append(index.fingerprints(store.circles, store.offsets))
+            else:
+                for uid, display in displays.items():
+                    uids.append(uid)
+                    keys.append(tuple(map(tuple, display['vertices'])))
+                    fingerprints.append(index.polygon_fingerprint(display['vertices'])[None])
+
+        report[kind] = find_duplicates(uids, keys, np.vstack(fingerprints), index)
+
+    return report
+
+
+if __name__ == '__main__':
+
+    import argparse
+    from qa_ans_stimuli import load_stimuli
+
+    parser = argparse.ArgumentParser(prog='ans_dedup',
+                                     description='Find uid collisions and near duplicate displays in a json stimuli file or npz display store.')
+
+    parser.add_argument('filename', help='The json stimuli or npz display store filename.')
+    parser.add_argument('-d', '--max-distance', dest='max_distance', default=None, type=float, required=False,
+                        help='The largest fraction of differing cells of near duplicates (default: %g for dots, %g for '
+                             'blobs).' % (MAX_DISTANCE, BLOB_MAX_DISTANCE))
+    parser.add_argument('-r', '--resolution', default=RESOLUTION, type=int, required=False,
+                        help='The cells per side of the fingerprint grid (default: %d).' % RESOLUTION)
+
+    args = parser.parse_args()
+
+    if args.filename.endswith('.npz'):
+        report = dict(dots=store_duplicates(DisplayStore.load(args.filename), resolution=args.resolution,
+                                            max_distance=args.max_distance or MAX_DISTANCE))
+    else:
+        report = stimuli_duplicates(load_stimuli(args.filename), max_distance=args.max_distance,
+                                    resolution=args.resolution)
+
+    for kind, duplicates in report.items():
+
+        print('%s: %d uid collisions, %d near duplicates' % (kind, len(duplicates['uid_collisions']),
+                                                              len(duplicates['near_duplicates'])))
+
+        for uid, key, other_key in duplicates['uid_collisions']:
+            print('  uid collision %s' % uid)
+        for uid, other_uid, distance in duplicates['near_duplicates']:
+            print('  near duplicate %s ~ %s (%.3f)' % (uid, other_uid, distance))
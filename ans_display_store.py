@@ -0,0 +1,238 @@
+"""
+Array-backed store of random dot displays.
+
+A `DisplayStore` keeps all the circles of all its displays in one contiguous
+(circles, 3) float array of (x, y, radius) rows, with an offsets array giving
+the circles of each display, and one array per display metric. Displays are
+addressed by row, or by uid through a sorted index, and the circles of a
+display are a view into the circle array, so no per-circle or per-display
+Python objects are kept.
+"""
+
+from collections import OrderedDict
+from itertools import chain
+
+import numpy as np
+
+# The per-display columns: name -> (dtype, shape of one entry)
+COLUMNS = OrderedDict([('uid', ('U7', ())),
+                       ('seed', (np.int64, ())),
+                       ('K', (np.int64, ())),
+                       ('density', (np.float64, ())),
+                       ('convex_hull_proportion', (np.float64, ())),
+                       ('bounding_circle', (np.float64, (3,))),
+                       ('radius_range', (np.float64, (2,)))])
+
+
+class DisplayStore(object):
+
+    """
+    Structure of arrays of random dot displays.
+
+    Appending grows the arrays geometrically. The arrays exposed as
+    attributes (`circles`, `offsets`, `uid`, `K`, ...) are views of the
+    filled part of the buffers.
+    """
+
+    def __init__(self, capacity=1024, circles_capacity=None):
+
+        self._n = 0
+        self._n_circles = 0
+
+        self._columns = {name: np.empty((capacity,) + shape, dtype=dtype)
+                         for name, (dtype, shape) in COLUMNS.items()}
+        self._circles = np.empty((circles_capacity or 64 * capacity, 3))
+        self._offsets = np.zeros(capacity + 1, dtype=np.int64)
+
+        self._index = None
+
+    def __len__(self):
+        return self._n
+
+    def __contains__(self, uid):
+        return self.row(uid, missing=None) is not None
+
+    def __getattr__(self, name):
+
+        if name in COLUMNS:
+            return self._columns[name][:self._n]
+
+        raise AttributeError(name)
+
+    @property
+    def circles(self):
+        return self._circles[:self._n_circles]
+
+    @property
+    def offsets(self):
+        return self._offsets[:self._n + 1]
+
+    @property
+    def nbytes(self):
+        "Bytes used by the filled part of the arrays"
+        return (self.circles.nbytes + self.offsets.nbytes +
+                sum(self._columns[name][:self._n].nbytes for name in COLUMNS))
+
+    def _reserve(self, n, n_circles):
+
+        if n > len(self._offsets) - 1:
+            capacity = max(n, 2 * (len(self._offsets) - 1))
+            for name, column in self._columns.items():
+                self._columns[name] = np.resize(column, (capacity,) + column.shape[1:])
+            self._offsets = np.resize(self._offsets, capacity + 1)
+
+        if n_circles > len(self._circles):
+            self._circles = np.resize(self._circles, (max(n_circles, 2 * len(self._circles)), 3))
+
+    def append(self, uid, seed, circles, density, convex_hull_proportion,
+               bounding_circle_parameters=(0.0, 0.0, 1.0), radius_range=(0.05, 0.1)):
+        "Append one display and return its row"
+
+        circles = np.asarray(circles, dtype=np.float64).reshape(-1, 3)
+
+        row, start = self._n, self._n_circles
+        self._reserve(row + 1, start + len(circles))
+
+        self._circles[start:start + len(circles)] = circles
+        self._offsets[row + 1] = start + len(circles)
+
+        values = dict(uid=uid, seed=seed, K=len(circles), density=density,
+                      convex_hull_proportion=convex_hull_proportion,
+                      bounding_circle=bounding_circle_parameters, radius_range=radius_range)
+        for name, value in values.items():
+            self._columns[name][row] = value
+
+        self._n += 1
+        self._n_circles += len(circles)
+        self._index = None
+
+        return row
+
+    def append_display(self, uid, display):
+        "Append a display dict, as made by `RandomDotDisplay.create`, and return its row"
+
+        return self.append(uid, display['seed'], display['circles'], display['density'],
+                           display['convex_hull_proportion'],
+                           display['bounding_circle_parameters'], display['radius_range'])
+
+    def extend(self, other):
+        "Append all the displays of the DisplayStore `other`"
+
+        n, n_circles = self._n + len(other), self._n_circles + len(other.circles)
+        self._reserve(n, n_circles)
+
+        self._circles[self._n_circles:n_circles] = other.circles
+        self._offsets[self._n + 1:n + 1] = other.offsets[1:] + self._n_circles
+        for name in COLUMNS:
+            self._columns[name][self._n:n] = getattr(other, name)
+
+        self._n, self._n_circles = n, n_circles
+        self._index = None
+
+    def row(self, uid, missing=KeyError):
+        "The row of the display `uid`, looked up by binary search in a sorted uid index"
+
+        if self._index is None:
+            self._index = np.argsort(self.uid, kind='stable')
+
+        i = np.searchsorted(self.uid, uid, sorter=self._index)
+
+        if i < len(self._index) and self.uid[self._index[i]] == uid:
+            return int(self._index[i])
+
+        if missing is KeyError:
+            raise KeyError(uid)
+
+        return missing
+
+    def circles_of(self, row):
+        "The (K, 3) circles of the display in `row`, as a view"
+        return self._circles[self._offsets[row]:self._offsets[row + 1]]
+
+    def display(self, row):
+        """
+        The display in `row` as a dict with the keys of the stimuli files,
+        with its circles as a view.
+        """
+
+        bounding_circle = self._columns['bounding_circle'][row]
+
+        D = OrderedDict()
+
+        D['seed'] = int(self._columns['seed'][row])
+        D['bounding_circle_parameters'] = bounding_circle.tolist()
+        D['bounding_circle_area'] = float(np.pi * bounding_circle[2]**2)
+        D['number_of_circles'] = int(self._columns['K'][row])
+        D['radius_range'] = self._columns['radius_range'][row].tolist()
+        D['convex_hull_proportion'] = float(self._columns['convex_hull_proportion'][row])
+        D['density'] = float(self._columns['density'][row])
+        D['circles'] = self.circles_of(row)
+
+        return D
+
+    def __getitem__(self, uid):
+        return self.display(self.row(uid))
+
+    def to_displays(self):
+        "The displays as the uid keyed dict of a stimuli file, ready to be dumped as json"
+
+        displays = OrderedDict()
+        for row, uid in enumerate(self.uid):
+            display = self.display(row)
+            display['circles'] = display['circles'].tolist()
+            displays[str(uid)] = display
+
+        return displays
+
+    @classmethod
+    def from_displays(cls, displays):
+        "Make a DisplayStore from the uid keyed displays dict of a stimuli file"
+
+        values = list(displays.values())
+
+        # all the circles are converted to one array at once
+        circles = np.array(list(chain.from_iterable(d['circles'] for d in values)),
+                           dtype=np.float64).reshape(-1, 3)
+        K = np.array([len(d['circles']) for d in values], dtype=np.int64)
+
+        return cls.from_arrays(circles=circles,
+                               offsets=np.concatenate(([0], np.cumsum(K))),
+                               uid=np.array(list(displays), dtype='U7'),
+                               seed=np.array([d['seed'] for d in values], dtype=np.int64),
+                               K=K,
+                               density=np.array([d['density'] for d in values], dtype=np.float64),
+                               convex_hull_proportion=np.array([d['convex_hull_proportion'] for d in values],
+                                                               dtype=np.float64),
+                               bounding_circle=np.array([d['bounding_circle_parameters'] for d in values],
+                                                        dtype=np.float64).reshape(-1, 3),
+                               radius_range=np.array([d['radius_range'] for d in values],
+                                                     dtype=np.float64).reshape(-1, 2))
+
+    @classmethod
+    def from_arrays(cls, circles, offsets, **columns):
+        """
+        Make a DisplayStore adopting, without copying, the (circles, 3) circle
+        array, the offsets of the displays in it and one array per column.
+        """
+
+        store = cls(capacity=0, circles_capacity=0)
+
+        store._circles = circles
+        store._offsets = offsets
+        store._columns = {name: columns[name] for name in COLUMNS}
+
+        store._n, store._n_circles = len(offsets) - 1, len(circles)
+
+        return store
+
+    def save(self, filename):
+        "Save the arrays to an uncompressed .npz file"
+        np.savez(filename, circles=self.circles, offsets=self.offsets,
+                 **{name: getattr(self, name) for name in COLUMNS})
+
+    @classmethod
+    def load(cls, filename):
+        "Load a DisplayStore saved with `save`, adopting the loaded arrays without copying"
+
+        with np.load(filename) as arrays:
+            return cls.from_arrays(**{name: arrays[name] for name in arrays.files})
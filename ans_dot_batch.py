@@ -0,0 +1,414 @@
+"""
+Batched generation of random dot displays.
+
+`make_dot_display_batch` generates M displays at once, as a padded
+(M, Kmax, 3) circle array with a validity mask, giving exactly the circles,
+uids and metrics of `RandomDotDisplay.create` for the same numbers of
+circles and seeds.
+
+`RandomDotDisplay` draws the seed of every placement attempt from its own
+`RandomState`, and the candidate circle from the global numpy state reseeded
+with it, so each display is a sequence of short MT19937 streams. Here those
+streams are computed for all displays at once by a vectorized MT19937 (the
+generator of `np.random.RandomState`), and the displays place their circles
+in lock step, one attempt of every unfinished display per vectorized
+collision check.
+
+Rare cases that the vectorized path does not reproduce (a zero attempt seed
+or a word outside the range of `randint`, a candidate circle needing more
+draws than precomputed) fall back to the scalar code for that display or
+candidate, so the output is always that of `RandomDotDisplay`. A repeated
+attempt seed needs no fallback: `RandomDotDisplay` skips it, and here it
+gives the candidate of its first attempt again, which collides with that
+circle if it was placed, or else with the circles it collided with before,
+so it is rejected and the next word is used in both.
+
+The displays are placed in chunks of `CHUNK_DISPLAYS`, so that the memory of
+the generator states does not grow with the batch. The
+convex hull proportions are computed with Qhull, exactly as
+`RandomDotDisplay`, optionally over a process pool, or with `hull='support'`
+from the batched support direction hull of `ans_hull`, a lower bound within
+5e-4 of the exact proportion at a fraction of the cost.
+"""
+
+from multiprocessing import Pool
+
+import numpy as np
+
+from ans_display_store import DisplayStore
+from ans_hull import hull_areas
+from generate_ans_stimuli import (BoundingCircle, RandomDotDisplay, display_dict, display_uid, maxint,
+                                  perimeter_points, random_circle)
+
+# MT19937 parameters
+MT_N, MT_M = 624, 397
+MATRIX_A = 0x9908b0df
+UPPER_MASK, LOWER_MASK = 0x80000000, 0x7fffffff
+
+# Words drawn per candidate circle stream: 8 tries of (x, y, radius) doubles
+CANDIDATE_WORDS = 48
+
+# Attempts of every display placed per round of candidate circle generation
+ROUND_ATTEMPTS = 32
+
+# Displays placed together; bounds the (624, CHUNK_DISPLAYS) generator state
+CHUNK_DISPLAYS = 1024
+
+# Displays per batched support hull computation, whose scores are (HULL_CHUNK, HULL_DIRECTIONS, Kmax)
+HULL_CHUNK = 256
+HULL_DIRECTIONS = 720
+
+HULL_METHODS = ('qhull', 'support')
+
+
+def _temper(y):
+
+    y = y ^ (y >> 11)
+    y = y ^ ((y << 7) & 0x9d2c5680)
+    y = y ^ ((y << 15) & 0xefc60000)
+
+    return y ^ (y >> 18)
+
+
+def _twist(upper, lower, skip):
+    "The new state words from old words `upper`, the next ones `lower` and the ones M ahead `skip`"
+
+    y = (upper & UPPER_MASK) | (lower & LOWER_MASK)
+
+    return skip ^ (y >> 1) ^ ((y & 1) * MATRIX_A)
+
+
+class MT19937Batch(object):
+
+    """
+    MT19937 generators seeded as `np.random.RandomState(seed)` for each of
+    `seeds`, advanced together. The state is a (624, len(seeds)) uint32
+    array, one generator per column.
+    """
+
+    def __init__(self, seeds):
+
+        self.state = np.empty((MT_N, len(seeds)), dtype=np.uint32)
+        self.state[0] = seeds
+
+        for i in range(1, MT_N):
+            x = self.state[i - 1]
+            self.state[i] = np.uint32(1812433253) * (x ^ (x >> 30)) + np.uint32(i)
+
+    def next_words(self):
+        "The next 624 32 bit outputs of every generator, as a (624, len(seeds)) array"
+
+        mt = self.state
+        n = MT_N - MT_M
+
+        mt[:n] = _twist(mt[:n], mt[1:n + 1], mt[MT_M:])
+        mt[n:2 * n] = _twist(mt[n:2 * n], mt[n + 1:2 * n + 1], mt[:n])
+        mt[2 * n:-1] = _twist(mt[2 * n:-1], mt[2 * n + 1:], mt[n:MT_N - 1 - n])
+        mt[-1] = _twist(mt[-1], mt[0], mt[MT_M - 1])
+
+        return _temper(mt)
+
+
+def first_words(seeds, n):
+    """
+    The first `n` (at most 227) 32 bit outputs of `np.random.RandomState(seed)`
+    for each of `seeds`, as a (n, len(seeds)) array.
+
+    Only the state words that the first outputs depend on are kept while
+    seeding, i.e. words 0 to n and M to M + n - 1.
+    """
+
+    assert n <= MT_N - MT_M
+
+    low = np.empty((n + 1, len(seeds)), dtype=np.uint32)
+    high = np.empty((n, len(seeds)), dtype=np.uint32)
+
+    x = low[0] = np.asarray(seeds, dtype=np.uint32)
+
+    for i in range(1, MT_M + n):
+
+        x = np.uint32(1812433253) * (x ^ (x >> 30)) + np.uint32(i)
+
+        if i <= n:
+            low[i] = x
+        elif i >= MT_M:
+            high[i - MT_M] = x
+
+    return _temper(_twist(low[:-1], low[1:], high))
+
+
+def _doubles(words):
+    "Doubles in [0, 1) from consecutive pairs of words, as `RandomState.random_sample`"
+    return ((words[0::2] >> 5).astype(np.float64) * 67108864.0 + (words[1::2] >> 6)) / 9007199254740992.0
+
+
+def candidate_circles(seeds, radius_range, bounding_circle):
+    """
+    The circles `random_circle` samples after `np.random.seed(seed)` for each
+    of `seeds`, as a (len(seeds), 3) array.
+    """
+
+    (x_low, x_high), (y_low, y_high) = bounding_circle.square
+    radius_low, radius_high = radius_range
+
+    doubles = _doubles(first_words(seeds, CANDIDATE_WORDS))
+
+    x = x_low + (x_high - x_low) * doubles[0::3]
+    y = y_low + (y_high - y_low) * doubles[1::3]
+    radius = radius_low + (radius_high - radius_low) * doubles[2::3]
+
+    inside = np.sqrt((bounding_circle.x - x)**2 + (bounding_circle.y - y)**2) + radius < bounding_circle.radius
+
+    # the first try inside the bounding circle
+    tries = np.argmax(inside, axis=0)
+    columns = np.arange(len(seeds))
+
+    circles = np.stack((x[tries, columns], y[tries, columns], radius[tries, columns]), axis=-1)
+
+    for i in np.flatnonzero(~inside.any(axis=0)):
+        np.random.seed(seeds[i])
+        circles[i] = random_circle(radius_range, bounding_circle)
+
+    return circles
+
+
+def _qhull_areas(args):
+    "Qhull areas of the perimeter points of each of the padded displays `circles`"
+
+    from scipy.spatial import ConvexHull
+
+    circles, K = args
+
+    return np.array([ConvexHull(perimeter_points(display[:k])).volume for display, k in zip(circles, K)])
+
+
+def _support_hull_areas(circles, mask):
+    "Batched support direction hull areas, in chunks of HULL_CHUNK displays"
+
+    return np.concatenate([np.zeros(0)] + [hull_areas(circles[i:i + HULL_CHUNK], mask[i:i + HULL_CHUNK],
+                                                      HULL_DIRECTIONS)
+                                           for i in range(0, len(circles), HULL_CHUNK)])
+
+
+class DotDisplayBatch(object):
+
+    """
+    M random dot displays as padded arrays.
+
+    `circles` is (M, Kmax, 3), with the circles of display i in
+    `circles[i, :K[i]]` and `mask` true there. `density` is computed for the
+    whole batch at once, `convex_hull_proportion` on first use, with one
+    Qhull call per display, spread over `processes` processes if given, or
+    with `hull='support'` from the batched support direction hull.
+    """
+
+    def __init__(self, K, seeds, circles, radius_range, bounding_circle, hull='qhull', processes=None):
+
+        if hull not in HULL_METHODS:
+            raise ValueError('Unknown hull method: %s' % hull)
+
+        self.K = K
+        self.seeds = seeds
+        self.circles = circles
+        self.mask = np.arange(circles.shape[1]) < K[:, None]
+
+        self.radius_range = radius_range
+        self.bounding_circle = bounding_circle
+
+        self.hull = hull
+        self.processes = processes
+
+        self.uids = [display_uid(seed, radius_range, k, bounding_circle) for k, seed in zip(K.tolist(), seeds)]
+
+        self._convex_hull_proportion = None
+
+    def __len__(self):
+        return len(self.K)
+
+    @property
+    def density(self):
+
+        areas = np.where(self.mask, np.pi * self.circles[:, :, 2]**2, 0.0)
+
+        # summed in order, as RandomDotDisplay.density does
+        total = np.zeros(len(self))
+        for k in range(areas.shape[1]):
+            total += areas[:, k]
+
+        return total / self.bounding_circle.area
+
+    @property
+    def convex_hull_proportion(self):
+
+        if self._convex_hull_proportion is None:
+            self._convex_hull_proportion = self._hull_areas() / self.bounding_circle.area
+
+        return self._convex_hull_proportion
+
+    def _hull_areas(self):
+
+        if self.hull == 'support':
+            return _support_hull_areas(self.circles, self.mask)
+
+        if not self.processes or self.processes == 1:
+            return _qhull_areas((self.circles, self.K))
+
+        size = -(-len(self) // (4 * self.processes)) or 1
+        chunks = [(self.circles[i:i + size], self.K[i:i + size]) for i in range(0, len(self), size)]
+
+        with Pool(self.processes) as pool:
+            return np.concatenate([np.zeros(0)] + pool.map(_qhull_areas, chunks))
+
+    def as_dicts(self):
+        "The displays as the dicts of `RandomDotDisplay.create`"
+
+        density, convex_hull_proportion = self.density, self.convex_hull_proportion
+
+        return [display_dict(uid, seed, self.bounding_circle, self.radius_range, self.circles[i, :self.K[i]],
+                             convex_hull_proportion[i], density[i])
+                for i, (uid, seed) in enumerate(zip(self.uids, self.seeds))]
+
+    def to_store(self):
+        "The displays as a DisplayStore, built from the arrays in one step"
+
+        M = len(self)
+
+        return DisplayStore.from_arrays(circles=self.circles[self.mask],
+                                        offsets=np.concatenate(([0], np.cumsum(self.K))),
+                                        uid=np.array(self.uids, dtype='U7'),
+                                        seed=np.asarray(self.seeds, dtype=np.int64),
+                                        K=self.K.astype(np.int64),
+                                        density=self.density,
+                                        convex_hull_proportion=self.convex_hull_proportion,
+                                        bounding_circle=np.tile(self.bounding_circle.parameters, (M, 1)),
+                                        radius_range=np.tile(self.radius_range, (M, 1)))
+
+
+def _place_circles(circles, K, seeds, radius_range, bounding_circle):
+    """
+    Place the circles of the displays with numbers of circles `K` and seeds
+    `seeds` into the zeroed padded array `circles`, in place.
+    """
+
+    M, Kmax = circles.shape[:2]
+    placed = np.zeros(M, dtype=np.int64)
+
+    # displays whose attempt seeds the vectorized path does not reproduce
+    scalar = np.zeros(M, dtype=bool)
+
+    generator = MT19937Batch(np.asarray(seeds, dtype=np.uint32))
+
+    rows = np.flatnonzero(placed < K)
+
+    while len(rows):
+
+        # RandomDotDisplay.generate_seed: randint(maxint) by masked rejection, and 0 is not reseeded
+        block = (generator.next_words() & 0x7fffffff).astype(np.int64)
+        scalar |= np.any((block == 0) | (block >= maxint), axis=0)
+
+        rows = rows[~scalar[rows]]
+
+        for attempt in range(0, MT_N, ROUND_ATTEMPTS):
+
+            if not len(rows):
+                break
+
+            round_seeds = block[attempt:attempt + ROUND_ATTEMPTS, rows]
+            candidates = candidate_circles(round_seeds.ravel(), radius_range,
+                                           bounding_circle).reshape(round_seeds.shape + (3,))
+
+            for step in range(len(candidates)):
+
+                candidate = candidates[step]
+                existing = circles[rows]
+                x, y, radius = candidate[:, 0:1], candidate[:, 1:2], candidate[:, 2:3]
+
+                distance = np.sqrt((x - existing[:, :, 0])**2 + (y - existing[:, :, 1])**2)
+                collides = np.any((distance < radius + existing[:, :, 2]) &
+                                  (np.arange(Kmax) < placed[rows, None]), axis=1)
+
+                accepted = rows[~collides]
+                circles[accepted, placed[accepted]] = candidate[~collides]
+                placed[accepted] += 1
+
+                unfinished = placed[rows] < K[rows]
+                rows, candidates = rows[unfinished], candidates[:, unfinished]
+
+                if not len(rows):
+                    break
+
+    for i in np.flatnonzero(scalar):
+        display = RandomDotDisplay(K=int(K[i]), radius_range=radius_range, bounding_circle=bounding_circle,
+                                   seed=seeds[i])
+        circles[i, :K[i]] = display.circles
+
+
+def make_dot_display_batch(K, seeds, radius_range=[0.05, 0.1], bounding_circle=None, hull='qhull',
+                           processes=None):
+    """
+    Generate the random dot displays with numbers of circles `K` and integer
+    seeds `seeds`, as a DotDisplayBatch equivalent to
+    `RandomDotDisplay.create(K=K[i], seed=seeds[i], ...)` for every i. Its
+    convex hull proportions are computed with `hull` and `processes` (see
+    DotDisplayBatch).
+    """
+
+    if not bounding_circle:
+        bounding_circle = BoundingCircle()
+
+    K = np.asarray(K, dtype=np.int64)
+    M, Kmax = len(K), int(K.max(initial=0))
+
+    circles = np.zeros((M, Kmax, 3))
+
+    for start in range(0, M, CHUNK_DISPLAYS):
+        chunk = slice(start, start + CHUNK_DISPLAYS)
+        _place_circles(circles[chunk], K[chunk], seeds[chunk], radius_range, bounding_circle)
+
+    return DotDisplayBatch(K, seeds, circles, radius_range, bounding_circle, hull=hull, processes=processes)
+
+
+def make_random_dot_display_batch(N, number_of_dots_range=(40, 60), radius_range=[0.05, 0.15],
+                                  bounding_circle_parameters=(0, 0, 1.0), seed=None, hull='qhull', processes=None):
+    "The N random dot displays of `make_random_dot_displays`, as a DotDisplayBatch"
+
+    _random = np.random.RandomState(seed)
+
+    K, seeds = [], []
+    for i in range(N):
+        K.append(_random.randint(*number_of_dots_range))
+        seeds.append(_random.randint(maxint))
+
+    return make_dot_display_batch(K, seeds, radius_range=radius_range,
+                                  bounding_circle=BoundingCircle(*bounding_circle_parameters),
+                                  hull=hull, processes=processes)
+
+
+if __name__ == '__main__':
+
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(prog='ans_dot_batch',
+                                     description='Generate a pool of random dot displays in batches and save it as a display store.')
+
+    parser.add_argument('-n', '--number', default=10000, type=int, required=False,
+                        help='The number of displays (default: 10000).')
+    parser.add_argument('-s', '--seed', default=None, type=int, required=False,
+                        help='The seed for the random number generator (default: None).')
+    parser.add_argument('-f', '--filename', default='displays.npz', required=False,
+                        help='The npz filename (default: displays.npz).')
+    parser.add_argument('--hull', choices=HULL_METHODS, default='qhull', required=False,
+                        help='The convex hull method: qhull (exact) or support (batched, a lower bound within '
+                             '5e-4) (default: qhull).')
+    parser.add_argument('-p', '--processes', default=None, type=int, required=False,
+                        help='The number of processes of qhull hulls (default: 1).')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    batch = make_random_dot_display_batch(args.number, seed=args.seed, hull=args.hull, processes=args.processes)
+    store = batch.to_store()
+    store.save(args.filename)
+
+    print('Generated %d displays in %.1f s' % (len(store), time.perf_counter() - start))
@@ -0,0 +1,92 @@
+"""
+Convex hull areas of the perimeter points of circles, from support directions.
+
+The perimeter points of a circle (`Circle.perimeter_points`) are one per
+degree. For a support direction theta, the extreme perimeter point of the
+circle (x, y, r) is at the whole degree phi nearest to theta, and its score
+along theta is x cos(theta) + y sin(theta) + r cos(theta - phi). The extreme
+points over all circles of a number of directions, in angular order, are a
+polygon inscribed in the hull of the perimeter points, whose shoelace area
+converges to the hull area as directions are added.
+
+ * `SupportHull` maintains that polygon as circles are added one by one.
+ * `hull_areas` computes it at once for a batch of padded displays.
+"""
+
+import numpy as np
+
+
+def support_directions(directions):
+    """
+    The (3, directions) matrix of the support directions, whose product with
+    (x, y, r) rows are the scores of circles, and the cosines and sines of
+    the perimeter angles phi of their extreme points.
+    """
+
+    theta = np.arange(directions) * 2 * np.pi / directions
+    phi = np.radians(np.round(np.degrees(theta)) % 360)
+
+    return np.stack((np.cos(theta), np.sin(theta), np.cos(theta - phi))), np.cos(phi), np.sin(phi)
+
+
+def shoelace_area(x, y):
+    "Area of the polygons with vertices `x`, `y` in order along the last axis"
+    return 0.5 * np.sum(x * np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1) * y, axis=-1)
+
+
+class SupportHull(object):
+
+    '''
+    Incrementally maintained lower bound on the area of the convex hull of
+    the perimeter points of a growing set of circles.
+
+    For each of `directions` support directions the extreme perimeter point
+    placed so far is kept, updated in one vectorized step per added circle.
+    '''
+
+    def __init__(self, directions=360):
+
+        self._support, self._cos_phi, self._sin_phi = support_directions(directions)
+
+        self.scores = np.full(directions, -np.inf)
+        self.x = np.zeros(directions)
+        self.y = np.zeros(directions)
+
+    def add(self, circle):
+
+        x, y, radius = circle
+
+        scores = np.asarray(circle) @ self._support
+        better = scores > self.scores
+
+        self.scores[better] = scores[better]
+        self.x[better] = x + radius * self._cos_phi[better]
+        self.y[better] = y + radius * self._sin_phi[better]
+
+    @property
+    def area(self):
+        return shoelace_area(self.x, self.y)
+
+
+def hull_areas(circles, mask, directions=720):
+    """
+    Area of the convex hull of the perimeter points of each display of the
+    padded (M, Kmax, 3) `circles`, with `mask` true for the real circles.
+
+    For each support direction the extreme circle is found across all
+    circles of all displays with one matrix product.
+    """
+
+    # padding repeats a real circle, which leaves the hull unchanged
+    circles = np.where(mask[..., None], circles, circles[:, :1])
+
+    support, cos_phi, sin_phi = support_directions(directions)
+
+    # (M, directions, Kmax) scores
+    scores = support.T @ circles.transpose(0, 2, 1)
+
+    extreme = np.take_along_axis(circles, scores.argmax(axis=2)[..., None], axis=1)
+    x = extreme[..., 0] + extreme[..., 2] * cos_phi
+    y = extreme[..., 1] + extreme[..., 2] * sin_phi
+
+    return shoelace_area(x, y)
@@ -0,0 +1,140 @@
+"""
+Response devices for the ANS task.
+
+A response device is started at stimulus onset, ideally from a
+`win.callOnFlip` callback on the first flip of the trial, and returns key
+presses as (key, rt) pairs, where rt is the time of the key event in seconds
+since the device was started.
+
+ * `KeyboardResponses` uses PsychoPy's `hardware.keyboard`, whose key events
+   are timestamped by the keyboard backend (psychtoolbox where available)
+   rather than when they are polled.
+ * `EventResponses` is the fallback using `psychopy.event`, timestamped when
+   polled.
+ * `ScriptedResponses` replays given responses, for tests and headless runs.
+
+`get_keys(key_list)` returns only the keys in `key_list`, and discards the
+others, so that they do not end a later screen.
+"""
+
+import time
+import warnings
+
+
+class KeyboardResponses(object):
+
+    "Key presses with their own timestamps from `psychopy.hardware.keyboard`"
+
+    name = 'keyboard'
+
+    def __init__(self):
+
+        from psychopy.hardware import keyboard
+
+        self.keyboard = keyboard.Keyboard()
+
+    def start(self):
+        self.keyboard.clock.reset()
+        self.keyboard.clearEvents()
+
+    def clear(self):
+        self.keyboard.clearEvents()
+
+    def get_keys(self, key_list=None):
+        # all keys are taken, so that the ones not listed are dropped rather than left in the buffer
+        return [(key.name, key.rt) for key in self.keyboard.getKeys(waitRelease=False)
+                if key_list is None or key.name in key_list]
+
+
+class EventResponses(object):
+
+    "Key presses from `psychopy.event`, timestamped when polled"
+
+    name = 'event'
+
+    def __init__(self):
+
+        from psychopy import core, event
+
+        self.event = event
+        self.clock = core.Clock()
+
+    def start(self):
+        self.clock.reset()
+
+    def clear(self):
+        self.event.clearEvents()
+
+    def get_keys(self, key_list=None):
+        # as KeyboardResponses.get_keys, keys not listed are dropped
+        return [(name, rt) for name, rt in self.event.getKeys(timeStamped=self.clock)
+                if key_list is None or name in key_list]
+
+
+class ScriptedResponses(object):
+
+    """
+    Replay scripted responses, one per started trial.
+
+    Each response is a (key, rt) pair, returned as soon as `rt` seconds have
+    passed since `start`, or None for no response.
+    """
+
+    name = 'scripted'
+
+    def __init__(self, responses=(), clock=time.perf_counter):
+
+        self.responses = iter(responses)
+        self.clock = clock
+
+        self._response = None
+        self._start_time = None
+
+    def start(self):
+        self._response = next(self.responses, None)
+        self._start_time = self.clock()
+
+    def clear(self):
+        pass
+
+    def get_keys(self, key_list=None):
+
+        if self._response is None:
+            return []
+
+        key, rt = self._response
+
+        if self.clock() - self._start_time < rt:
+            return []
+
+        self._response = None
+
+        # as the other devices, a key not listed is dropped
+        if key_list is not None and key not in key_list:
+            return []
+
+        return [(key, rt)]
+
+
+def make_response_device(name='keyboard', **kwargs):
+    """
+    Make the response device `name`: 'keyboard', falling back to 'event'
+    with a warning if `psychopy.hardware.keyboard` or its backend is not
+    available, 'event', or 'scripted', made with `kwargs` (its responses and
+    clock).
+    """
+
+    if name == 'keyboard':
+        try:
+            return KeyboardResponses()
+        except (ImportError, OSError, RuntimeError) as error:
+            # the session then records the 'event' device, with RTs timestamped when polled
+            warnings.warn('Keyboard responses unavailable (%s): falling back to psychopy.event, '
+                          'with RTs timestamped when polled' % error)
+            return EventResponses()
+    elif name == 'event':
+        return EventResponses()
+    elif name == 'scripted':
+        return ScriptedResponses(**kwargs)
+
+    raise ValueError('Unknown response device: %s' % name)
@@ -0,0 +1,103 @@
+"""
+Reading and writing ANS task stimuli files.
+
+A stimuli file is the json list of blocks of `generate_ans_stimuli.py`,
+preceded by a small header on the first line:
+
+    {"header": {"format_version": 2, "blocks": 4, "trials_per_block": {...}, "checksum": "..."},
+    "blocks": [
+        ...
+    ]}
+
+so that the number of blocks and trials of a file are read from its first
+line, without parsing any geometry. The checksum is the sha1 of the blocks
+json as written. Files of format version 1, the bare list of blocks, are
+still read; they have no header.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+FORMAT_VERSION = 2
+
+HEADER_PREFIX = '{"header": '
+BLOCKS_PREFIX = '"blocks": '
+
+
+def stimuli_header(blocks_stimuli, checksum=None):
+    "The header of a list of blocks, with the checksum of their json if known"
+
+    return dict(format_version=FORMAT_VERSION,
+                blocks=len(blocks_stimuli),
+                trials_per_block={kind: [len(block_stimuli[kind]['stimuli']) for block_stimuli in blocks_stimuli]
+                                  for kind in ('dots', 'blobs')},
+                checksum=checksum)
+
+
+def write_stimuli(blocks_stimuli, filename):
+    "Write a list of blocks to `filename`, with its header"
+
+    blocks = json.dumps(blocks_stimuli, indent=4)
+    header = stimuli_header(blocks_stimuli, hashlib.sha1(blocks.encode('utf-8')).hexdigest())
+
+    with open(filename, 'w') as f:
+        f.write(HEADER_PREFIX + json.dumps(header) + ',\n' + BLOCKS_PREFIX + blocks + '}\n')
+
+
+def read_header(filename):
+    "The header of a stimuli file, read from its first line only, or None for a file without header"
+
+    with open(filename, 'r') as f:
+        line = f.readline().rstrip()
+
+    if not (line.startswith(HEADER_PREFIX) and line.endswith(',')):
+        return None
+
+    return json.loads(line[len(HEADER_PREFIX):-1])
+
+
+def read_stimuli(filename, loads=json.loads, verify=False):
+    """
+    The list of blocks of a stimuli file, of either format version, parsed
+    with `loads`. With `verify`, the checksum of the header is checked.
+    """
+
+    with open(filename, 'r') as f:
+        text = f.read()
+
+    if not text.startswith(HEADER_PREFIX):
+        return loads(text)
+
+    first_line, rest = text.split('\n', 1)
+    header = json.loads(first_line[len(HEADER_PREFIX):-1])
+    blocks = rest[len(BLOCKS_PREFIX):rest.rindex('}')]
+
+    if verify and hashlib.sha1(blocks.encode('utf-8')).hexdigest() != header['checksum']:
+        raise ValueError('Checksum mismatch in stimuli file %s' % filename)
+
+    return loads(blocks)
+
+
+def stimuli_files(directory='.'):
+    """
+    The (name, header) of the stimuli files in `directory`, named as in
+    `ans_task.py` without the .json extension, from their first lines only.
+    The header is None for files without header.
+    """
+
+    files = []
+    for filename in sorted(glob.glob(os.path.join(directory, '*.json'))):
+
+        if filename.endswith('_results.json'):
+            continue
+
+        with open(filename, 'r') as f:
+            start = f.read(len(HEADER_PREFIX))
+
+        # skip other json files, as the qa reports; files without header are lists
+        if start == HEADER_PREFIX or start.startswith('['):
+            files.append((os.path.splitext(os.path.basename(filename))[0], read_header(filename)))
+
+    return files
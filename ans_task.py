@@ -1,10 +1,16 @@
-from psychopy import visual, event, core, gui
+from psychopy import gui
 import inspect
 import time
 import json
 import numpy as np
 from datetime import datetime
 
+from ans_adaptive import AdaptiveSelector, is_correct
+from ans_display_store import DisplayStore
+from ans_responses import make_response_device
+from ans_stimuli_file import read_stimuli, stimuli_files, stimuli_header
+from ans_triggers import RecordingParallelPort, TriggerScheduler
+
 
 # ============================= Parameters ====================================================
 
@@ -12,9 +18,45 @@ results_date_time_stamp = datetime.now().strftime("%m_%d_%Y_%H_%M_%S")
 
 # ============================= Dialog Box =====================================================
 
+
+def block_trials(header, kind):
+    "The number of trials of `kind` per block of a stimuli header, 0 for a file without blocks"
+    counts = header["trials_per_block"][kind]
+    return counts[0] if counts else 0
+
+
+def stimuli_label(name, header):
+    "The name of a stimuli file with its counts from its header, if it has one"
+    if header is None:
+        return name
+    return "%s (%d blocks, %d dots + %d shapes trials)" % (
+        name,
+        header["blocks"],
+        block_trials(header, "dots"),
+        block_trials(header, "blobs"),
+    )
+
+
+def quit_with_message(message):
+    "Show `message` in an error dialog and quit"
+    from psychopy import core
+
+    gui.criticalDlg("ANS Task Experiment", message)
+    core.quit()
+
+
+# The stimuli files of the current directory, found from their first lines only
+STIMULI_FILES = {stimuli_label(name, header): (name, header) for name, header in stimuli_files(".")}
+
+if not STIMULI_FILES:
+    quit_with_message(
+        "No stimuli files found in the current directory.\n"
+        "Generate one with generate_ans_stimuli.py first."
+    )
+
 expInfo = {
     "Participant ID": "",
-    "Stimuli file": ["stimuli_3_30_103", "stimuli_4_50_1010101", "stimuli_4_5_1010101", "stimuli_3_50_103"],
+    "Stimuli file": list(STIMULI_FILES),
     "Break duration": [
         100,
         10,
@@ -27,6 +69,8 @@ expInfo = {
     "Gender": ["Female", "Male", "Non-binary", "Prefer not to say"],
     "ISI": [1.0, 2.0, 3.0, 5.0],
     "Trial timeout": [10, 5, 1, 0.5],
+    "Response device": ["keyboard", "event"],
+    "Trial selection": ["fixed", "bayesian", "staircase"],
 }  # Number of seconds before trial times out and moves on
 
 dlg = gui.DlgFromDict(
@@ -43,18 +87,27 @@ dlg = gui.DlgFromDict(
         "ISI",
         "Fullscreen",
         "Parallel port",
+        "Response device",
+        "Trial selection",
     ],
 )
 
 if not dlg.OK:
+    from psychopy import core
+
     core.quit()
 
+# The window and its dependencies are only imported once the dialog is accepted
+from psychopy import visual, event, core
+
 TRIAL_TIMEOUT = float(expInfo["Trial timeout"])
 BREAK_DURATION = int(expInfo["Break duration"])
-STIMULI_FILENAME = expInfo["Stimuli file"]
+STIMULI_FILENAME, STIMULI_HEADER = STIMULI_FILES[expInfo["Stimuli file"]]
 USE_FULLSCREEN = expInfo["Fullscreen"]
 USE_PARALLEL_PORT = expInfo["Parallel port"]
 ISI = float(expInfo["ISI"])  # probably should be around 1
+RESPONSE_DEVICE = expInfo["Response device"]
+TRIAL_SELECTION = expInfo["Trial selection"]  # fixed shows the pairs in file order
 
 # ============================= Set up =====================================================
 
@@ -64,6 +117,9 @@ trialClock = core.Clock()
 
 win = visual.Window(size=(1000, 1000), fullscr=USE_FULLSCREEN, color="white")
 
+# Event-timestamped key presses; falls back to psychopy.event without hardware.keyboard
+responses = make_response_device(RESPONSE_DEVICE)
+
 width, height = win.size
 LEFT_CENTRE = -width / 4
 RIGHT_CENTRE = width / 4
@@ -74,15 +130,8 @@ if USE_PARALLEL_PORT:
     from psychopy import parallel
 else:
     # Used to disable parallel port during development.
-    # Basically, port functions are ignored.
-    class Parallel(object):
-        def setData(self, x):
-            print("Trigger: " + str(x))
-
-        def setPortAddress(self, address):
-            pass
-
-    parallel = Parallel()
+    # Trigger codes are recorded with their send times instead.
+    parallel = RecordingParallelPort(clock=core.monotonicClock.getTime)
 
 # copied from previous Psychopy trigger code
 parallel.setPortAddress(address=0x0378)
@@ -102,9 +151,18 @@ trigger_dict = dict(
     no_response=18,
 )
 
+# Triggers are sent on the flip following fire_trigger, and logged with their flip timestamps,
+# which win.flip() takes from core.monotonicClock
+trigger_scheduler = TriggerScheduler(parallel, trigger_dict, clock=core.monotonicClock.getTime)
+
 
 def fire_trigger(label):
-    parallel.setData(trigger_dict[label])
+    trigger_scheduler.queue(label)
+
+
+def flip():
+    "Flip the window, sending any queued triggers on the flip"
+    return trigger_scheduler.flip(win)
 
 
 # ============================= UTILS ==========================================================
@@ -117,9 +175,13 @@ def this_module_as_string():
 
 
 def load_stimuli(filename="stimuli"):
-    "Load the ANS task stimuli"
-    with open(filename + ".json", "r") as f:
-        stimuli = json.load(f)
+    "Load the ANS task stimuli, with the dot displays of each block in a DisplayStore"
+    stimuli = read_stimuli(filename + ".json")
+
+    for block_stimuli in stimuli:
+        block_stimuli["dots"]["displays"] = DisplayStore.from_displays(
+            block_stimuli["dots"]["displays"]
+        )
 
     return stimuli
 
@@ -156,45 +218,60 @@ class DotDisplayObject:
         return None
 
 
-def show_dots(dots_stimuli):
+def trial_pairs(stimuli, selector=None):
+    "The (left uid, right uid, displays) of each trial: in file order, or chosen by `selector`"
+    if selector is None:
+        for left_uid, right_uid in stimuli["stimuli"]:
+            yield left_uid, right_uid, stimuli["displays"]
+    else:
+        for _ in range(len(stimuli["stimuli"])):
+            pair = selector.next_pair()
+            if pair is None:
+                return
+            yield pair
+
+
+def show_dots(dots_stimuli, selector=None):
     results = []
-    for left_uid, right_uid in dots_stimuli["stimuli"]:
+    for left_uid, right_uid, displays in trial_pairs(dots_stimuli, selector):
         # these two displays take around 1 second to draw
         left_display = DotDisplayObject(
-            circles=dots_stimuli["displays"][left_uid]["circles"],
+            circles=displays[left_uid]["circles"],
             window=win,
             centre=LEFT_CENTRE,
             scale=SCALE,
         )
 
         right_display = DotDisplayObject(
-            circles=dots_stimuli["displays"][right_uid]["circles"],
+            circles=displays[right_uid]["circles"],
             window=win,
             centre=RIGHT_CENTRE,
             scale=SCALE,
         )
 
-        left_number_circles = dots_stimuli["displays"][left_uid]["number_of_circles"]
-        right_number_circles = dots_stimuli["displays"][right_uid]["number_of_circles"]
+        left_number_circles = displays[left_uid]["number_of_circles"]
+        right_number_circles = displays[right_uid]["number_of_circles"]
 
         start_time_clock = trialClock.getTime()
         start_time_time = time.time()
 
-        event.clearEvents()
+        clear_keys()
 
         # Dot display trial start trigger
         fire_trigger("start_dot_trial")
+        # RTs from the response device are timed from the first flip of the trial
+        win.callOnFlip(responses.start)
 
         while True:
             left_display.draw()
             right_display.draw()
 
-            win.flip()
+            flip()
 
             # listen for key press
-            keys_pressed = event.getKeys()
+            keys_pressed = responses.get_keys(["left", "right", "escape"])
             if len(keys_pressed) > 0:  # at least one key was pressed
-                key_pressed = keys_pressed[0]
+                key_pressed, rt_event = keys_pressed[0]
                 if key_pressed in ("left", "right", "escape"):
                     # Dot display response trigger
                     if key_pressed == "left":
@@ -208,6 +285,7 @@ def show_dots(dots_stimuli):
 
             if time.time() - start_time_time > TRIAL_TIMEOUT:
                 key_pressed = None
+                rt_event = None
                 fire_trigger("no_response")  # No response, timeout
                 break
 
@@ -223,52 +301,59 @@ def show_dots(dots_stimuli):
                 key_pressed=key_pressed,
                 rt_time=rt_time,
                 rt_clock=rt_clock,
+                rt_event=rt_event,
             )
         )
 
+        if selector is not None:
+            selector.update(is_correct(key_pressed, left_number_circles, right_number_circles))
+            results[-1].update(selector.history[-1])
+
         add_isi(win, ISI)  # Interval stimulus interval
 
     return results
 
 
-def show_blobs(blobs_stimuli):
+def show_blobs(blobs_stimuli, selector=None):
     results = []
-    for left_uid, right_uid in blobs_stimuli["stimuli"]:
+    for left_uid, right_uid, displays in trial_pairs(blobs_stimuli, selector):
         left_display = BlobDisplayObject(
-            vertices=blobs_stimuli["displays"][left_uid]["vertices"],
+            vertices=displays[left_uid]["vertices"],
             window=win,
             centre=LEFT_CENTRE,
             scale=SCALE,
         )
 
         right_display = BlobDisplayObject(
-            vertices=blobs_stimuli["displays"][right_uid]["vertices"],
+            vertices=displays[right_uid]["vertices"],
             window=win,
             centre=RIGHT_CENTRE,
             scale=SCALE,
         )
 
-        left_blob_area = blobs_stimuli["displays"][left_uid]["area"]
-        right_blob_area = blobs_stimuli["displays"][right_uid]["area"]
+        left_blob_area = displays[left_uid]["area"]
+        right_blob_area = displays[right_uid]["area"]
 
         start_time_clock = trialClock.getTime()
         start_time_time = time.time()
 
-        event.clearEvents()
+        clear_keys()
 
         # Blob display trial start trigger
         fire_trigger("start_blob_trial")
+        # RTs from the response device are timed from the first flip of the trial
+        win.callOnFlip(responses.start)
 
         while True:
             left_display.draw()
             right_display.draw()
 
-            win.flip()
+            flip()
 
             # listen for key press
-            keys_pressed = event.getKeys()
+            keys_pressed = responses.get_keys(["left", "right", "escape"])
             if len(keys_pressed) > 0:  # at least one key was pressed
-                key_pressed = keys_pressed[0]
+                key_pressed, rt_event = keys_pressed[0]
                 if key_pressed in ("left", "right", "escape"):
                     # Blob display response trigger
                     # Trigger codes for left/right same as for dot displays
@@ -285,6 +370,7 @@ def show_blobs(blobs_stimuli):
 
             if time.time() - start_time_time > TRIAL_TIMEOUT:
                 key_pressed = None
+                rt_event = None
                 fire_trigger("no_response")
                 break
 
@@ -300,9 +386,14 @@ def show_blobs(blobs_stimuli):
                 key_pressed=key_pressed,
                 rt_time=rt_time,
                 rt_clock=rt_clock,
+                rt_event=rt_event,
             )
         )
 
+        if selector is not None:
+            selector.update(is_correct(key_pressed, left_blob_area, right_blob_area))
+            results[-1].update(selector.history[-1])
+
         add_isi(win, ISI)  # Interval stimulus interval
 
     return results
@@ -313,20 +404,27 @@ def show_block_start(text="Block"):
     start_text.setText(text)
     while True:
         start_text.draw()
-        win.flip()
+        flip()
 
         if time.time() - start_time > 2:
             break
 
 
+def clear_keys():
+    "Discard pending key presses of both psychopy.event and the response device, which buffer separately"
+    event.clearEvents()
+    responses.clear()
+
+
 def countdown(tics=100):
+    clear_keys()
     start_time = time.time()
 
     while True:
         time_elapsed = time.time() - start_time
         instrtext.setText(COUNTDOWN % (tics - time_elapsed))
         instrtext.draw()
-        win.flip()
+        flip()
 
         if time_elapsed > tics:
             break
@@ -342,17 +440,18 @@ def add_isi(win, duration):
     "Add a blank screen for `duration` seconds"
     isi_start_time = trialClock.getTime()
     while True:
-        win.flip()
+        flip()
         if trialClock.getTime() - isi_start_time >= duration:
             break
 
 
 def show_instructions(text):
+    clear_keys()
     instrtext.setText(text)
 
     while True:
         instrtext.draw()
-        win.flip()
+        flip()
         # listen for key press
         keys_pressed = event.getKeys()
         if len(keys_pressed) > 0:  # at least one key was pressed
@@ -363,7 +462,18 @@ def show_instructions(text):
 
 # =============================================================================
 
-blocks_stimuli = load_stimuli(filename=STIMULI_FILENAME)
+# The counts of the instructions are those of the header; files without header are parsed for them
+blocks_stimuli = None
+if STIMULI_HEADER is None:
+    blocks_stimuli = load_stimuli(filename=STIMULI_FILENAME)
+    STIMULI_HEADER = stimuli_header(blocks_stimuli)
+
+N_BLOCKS = STIMULI_HEADER["blocks"]
+N_DOTS_TRIALS = block_trials(STIMULI_HEADER, "dots")
+N_BLOBS_TRIALS = block_trials(STIMULI_HEADER, "blobs")
+
+if N_BLOCKS == 0:
+    quit_with_message("The stimuli file %s has no blocks." % STIMULI_FILENAME)
 
 INSTRUCTIONS_TEXT_1 = """
 In this experiment, on each trial, you will be shown
@@ -390,9 +500,9 @@ In each block, you will be reminded of the task instructions.
 
 Press any key to begin the first block.
 """ % (
-    len(blocks_stimuli),
-    len(blocks_stimuli[0]["dots"]["stimuli"]),
-    len(blocks_stimuli[0]["blobs"]["stimuli"]),
+    N_BLOCKS,
+    N_DOTS_TRIALS,
+    N_BLOBS_TRIALS,
 )
 
 
@@ -410,7 +520,7 @@ If you think the set of the right has more dots, press
 the "right" key. 
 
 Press any key to begin the trials.
-""" % (len(blocks_stimuli[0]["dots"]["stimuli"]))
+""" % (N_DOTS_TRIALS)
 
 BLOBS_INSTRUCTIONS_TEXT = """
 You are now going to be shown %d shapes trials.
@@ -426,7 +536,7 @@ If you think the shape on the right is larger, press
 the "right" key. 
 
 Press any key to begin the trials.
-""" % (len(blocks_stimuli[0]["dots"]["stimuli"]))
+""" % (N_BLOBS_TRIALS)
 
 COUNTDOWN = """
 Take a break before the next trial: %d
@@ -450,9 +560,27 @@ fire_trigger("show_instructions")
 show_instructions(INSTRUCTIONS_TEXT_1)
 show_instructions(INSTRUCTIONS_TEXT_2)
 
+# The geometry is only parsed now, after the instructions were shown from the header
+if blocks_stimuli is None:
+    blocks_stimuli = load_stimuli(filename=STIMULI_FILENAME)
 
 dots_blobs_order = ["dots", "blobs"]
 
+# In adaptive mode, the pairs of each type are chosen online from an index over the pool of
+# displays of the file, built once; each block still runs its number of trials of the file
+if TRIAL_SELECTION == "fixed":
+    selectors = dict(dots=None, blobs=None)
+else:
+    selectors = {
+        kind: AdaptiveSelector.from_stimuli(
+            blocks_stimuli,
+            kind,
+            TRIAL_SELECTION,
+            n_trials=sum(STIMULI_HEADER["trials_per_block"][kind]),
+        )
+        for kind in dots_blobs_order
+    }
+
 experiment_information = {}
 experiment_information["code"] = this_module_as_string()
 experiment_information["participant_id"] = expInfo["Participant ID"]
@@ -460,10 +588,14 @@ experiment_information["participant_gender"] = expInfo["Gender"]
 experiment_information["participant_age"] = expInfo["Age"]
 experiment_information["participant_handedness"] = expInfo["Handedness"]
 experiment_information["fullscreen"] = USE_FULLSCREEN
-experiment_information["stimuli_file"] = expInfo["Stimuli file"]
+experiment_information["stimuli_file"] = STIMULI_FILENAME
+experiment_information["stimuli_checksum"] = STIMULI_HEADER["checksum"]
 experiment_information["trial_timeout"] = expInfo["Trial timeout"]
 experiment_information["break_duration"] = expInfo["Break duration"]
 experiment_information["datetime"] = results_date_time_stamp
+experiment_information["response_device"] = responses.name
+experiment_information["trial_selection"] = TRIAL_SELECTION
+experiment_information["triggers"] = trigger_scheduler.log
 
 RESULTS = [experiment_information]
 
@@ -479,13 +611,13 @@ for k, block_stimuli in enumerate(blocks_stimuli):
         if dots_or_blobs == "dots":
             show_instructions(DOTS_INSTRUCTIONS_TEXT)
             dots_stimuli = block_stimuli["dots"]
-            results = show_dots(dots_stimuli=dots_stimuli)
+            results = show_dots(dots_stimuli=dots_stimuli, selector=selectors["dots"])
             RESULTS.append(dict(block=k + 1, type="dots", results=results))
 
         elif dots_or_blobs == "blobs":
             show_instructions(BLOBS_INSTRUCTIONS_TEXT)
             blobs_stimuli = block_stimuli["blobs"]
-            results = show_blobs(blobs_stimuli=blobs_stimuli)
+            results = show_blobs(blobs_stimuli=blobs_stimuli, selector=selectors["blobs"])
             RESULTS.append(dict(block=k + 1, type="blobs", results=results))
 
     # write results to file
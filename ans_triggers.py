@@ -0,0 +1,136 @@
+"""
+Flip-locked trigger delivery for the ANS task.
+
+Trigger codes are queued with `TriggerScheduler.queue` and written to the
+port from within the next window flip, right after the buffer swap, so that
+every EEG marker is tied to the frame on which the display changed. Every
+trigger is logged with its send time and the timestamp of the flip it was
+locked to, on the same clock: in the task `core.monotonicClock.getTime`,
+the clock of the timestamps returned by PsychoPy's `Window.flip()`.
+"""
+
+import time
+
+import numpy as np
+
+
+class RecordingParallelPort(object):
+
+    """
+    Stand-in for the parallel port, used during development and in tests.
+
+    Every code written with `setData` is recorded with its send time, and
+    optionally printed.
+    """
+
+    def __init__(self, clock=time.perf_counter, echo=True):
+
+        self.clock = clock
+        self.echo = echo
+        self.address = None
+        self.data = []
+
+    def setData(self, x):
+
+        self.data.append((x, self.clock()))
+
+        if self.echo:
+            print("Trigger: " + str(x))
+
+    def setPortAddress(self, address):
+        self.address = address
+
+
+class TriggerScheduler(object):
+
+    """
+    Queue trigger codes to be sent on the next flip of a window.
+
+    `flip(win)` replaces `win.flip()`. If triggers are queued, they are sent
+    by a `win.callOnFlip` callback, i.e. immediately after the buffer swap,
+    and logged with the flip timestamp returned by `win.flip()`. `clock` must
+    be the clock of those timestamps, which for PsychoPy windows is
+    `logging.defaultClock`, i.e. `psychopy.core.monotonicClock.getTime`
+    (not `core.getTime`, which is absolute time).
+
+    The latency of a trigger is its send time minus the flip timestamp.
+    PsychoPy reads the timestamp right after the buffer swap and then runs
+    the `callOnFlip` callbacks, so latencies are normally small and
+    positive: the time the trigger went out after the flip was timestamped,
+    including the callbacks queued before it. A negative latency would mean
+    the clocks of the port and the window differ.
+    """
+
+    def __init__(self, port, codes, clock=time.perf_counter):
+
+        self.port = port
+        self.codes = codes
+        self.clock = clock
+
+        self.log = []
+        self.frame = 0
+
+        self._queued = []
+        self._sent = []
+
+    def queue(self, label):
+        "Queue the trigger `label` to be sent on the next flip"
+        self._queued.append(dict(label=label, code=self.codes[label], queued=self.clock()))
+
+    def send(self, label):
+        "Send the trigger `label` now, without waiting for a flip"
+
+        record = dict(label=label, code=self.codes[label], queued=self.clock())
+        self._send(record)
+        self.log.append(dict(record, frame=None, flip=None, latency=None))
+
+    def _send(self, record):
+        self.port.setData(record['code'])
+        record['sent'] = self.clock()
+
+    def _send_queued(self):
+
+        queued, self._queued = self._queued, []
+
+        for record in queued:
+            self._send(record)
+
+        self._sent.extend(queued)
+
+    def flip(self, win):
+        "Flip `win`, sending any queued triggers on the flip, and return the flip timestamp"
+
+        if self._queued:
+            win.callOnFlip(self._send_queued)
+
+        flip_time = win.flip()
+        self.frame += 1
+
+        for record in self._sent:
+            record['frame'] = self.frame
+            record['flip'] = flip_time
+            record['latency'] = (record['sent'] - flip_time) if flip_time is not None else None
+            self.log.append(record)
+
+        self._sent = []
+
+        return flip_time
+
+    def latencies(self, label=None):
+        "Trigger to flip latencies in seconds, optionally of one trigger label only"
+        return np.array([record['latency'] for record in self.log
+                         if record['latency'] is not None and label in (None, record['label'])])
+
+    def summary(self):
+        "Mean, standard deviation and maximum trigger to flip latency of each trigger label"
+
+        summary = {}
+        for label in sorted(set(record['label'] for record in self.log)):
+            latencies = self.latencies(label)
+            if len(latencies):
+                summary[label] = dict(n=len(latencies),
+                                      mean=float(latencies.mean()),
+                                      sd=float(latencies.std()),
+                                      max=float(latencies.max()))
+
+        return summary
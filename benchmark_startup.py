@@ -0,0 +1,118 @@
+"""
+Startup time benchmarks of the generator and the task.
+
+Every case runs in a fresh interpreter, as a user would start it, and the
+median wall time of `--repeat` runs is reported.
+
+ * generate_ans_stimuli: importing the module, and its --help.
+ * ans_task: importing the PsychoPy modules needed for the dialog, and
+   for the experiment (skipped if PsychoPy is not installed), listing the
+   stimuli files from their headers, and fully parsing each of them.
+ * ans_task.py itself, run in the stimuli directory until its dialog shows,
+   which then quits: with a stand-in for psychopy.gui, for the time the task
+   takes on its own, and with PsychoPy's gui (skipped if not installed), for
+   the time a participant waits for the dialog. Their difference with the
+   PsychoPy imports above is the time saved by importing the window only
+   once the dialog is accepted.
+
+    python benchmark_startup.py --repeat 10
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+TASK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ans_task.py')
+
+# Runs the task in a directory until its dialog, which quits, with `gui` set up by the first placeholder
+TASK_UNTIL_DIALOG = """
+import os, runpy, sys, types
+
+def dialog(*args, **kwargs):
+    raise SystemExit(0)
+
+def error_dialog(title, message):
+    raise SystemExit(message)
+
+%s
+gui.DlgFromDict, gui.criticalDlg = dialog, error_dialog
+
+sys.path.insert(0, %r)
+os.chdir(%r)
+runpy.run_path(%r, run_name='__main__')
+"""
+
+STAND_IN_GUI = """
+psychopy, gui = types.ModuleType('psychopy'), types.ModuleType('psychopy.gui')
+psychopy.gui = gui
+sys.modules.update({'psychopy': psychopy, 'psychopy.gui': gui})
+"""
+
+
+def run_time(code, repeat=5, args=()):
+    "Median wall time in seconds of running `code` (python -c), or a script with `args`, in a fresh interpreter"
+
+    command = [sys.executable] + (list(args) if args else ['-c', code])
+
+    times = []
+    for _ in range(repeat):
+
+        start = time.perf_counter()
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+        if completed.returncode != 0:
+            return None
+
+    return float(np.median(times))
+
+
+def task_until_dialog(gui, stimuli_dir):
+    "The code running ans_task.py in `stimuli_dir` until its dialog, with the psychopy.gui set up by `gui`"
+    return TASK_UNTIL_DIALOG % (gui, os.path.dirname(TASK), os.path.abspath(stimuli_dir), TASK)
+
+
+def benchmarks(stimuli_dir='.', repeat=5):
+    "The (case, median seconds or None if it could not run) of every benchmark"
+
+    cases = [('python (baseline)', 'pass', ()),
+             ('import numpy', 'import numpy', ()),
+             ('import generate_ans_stimuli', 'import generate_ans_stimuli', ()),
+             ('import scipy.spatial (no longer at generator import)', 'import scipy.spatial', ()),
+             ('generate_ans_stimuli.py --help', None, ('generate_ans_stimuli.py', '--help')),
+             ('import psychopy.gui (dialog)', 'from psychopy import gui', ()),
+             ('import psychopy.visual, event, core', 'from psychopy import visual, event, core', ()),
+             ('list stimuli files (headers)',
+              'from ans_stimuli_file import stimuli_files; stimuli_files(%r)' % stimuli_dir, ()),
+             ('ans_task.py until the dialog (stand-in gui)', task_until_dialog(STAND_IN_GUI, stimuli_dir), ()),
+             ('ans_task.py until the dialog (psychopy.gui)', task_until_dialog('from psychopy import gui', stimuli_dir),
+              ())]
+
+    from ans_stimuli_file import stimuli_files
+
+    for name, header in stimuli_files(stimuli_dir):
+        filename = os.path.join(stimuli_dir, name + '.json')
+        cases.append(('parse %s%s' % (name, '' if header else ' (no header)'),
+                      'from ans_stimuli_file import read_stimuli; read_stimuli(%r)' % filename, ()))
+
+    return [(case, run_time(code, repeat, args)) for case, code, args in cases]
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(prog='benchmark_startup',
+                                     description='Measure the startup times of the generator and the task.')
+
+    parser.add_argument('-r', '--repeat', default=5, type=int, required=False,
+                        help='The number of runs of every case (default: 5).')
+    parser.add_argument('-d', '--stimuli-dir', dest='stimuli_dir', default='.', required=False,
+                        help='The directory of the stimuli files (default: current directory).')
+
+    args = parser.parse_args()
+
+    for case, seconds in benchmarks(args.stimuli_dir, args.repeat):
+        print('%-55s %s' % (case, 'not available' if seconds is None else '%8.1f ms' % (1000 * seconds)))
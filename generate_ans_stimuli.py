@@ -1,14 +1,20 @@
 from collections import OrderedDict
 import hashlib
+import time
 
 import numpy as np
 from numpy import array
 from numpy.random import rand, uniform, randint
 from math import radians
-from scipy.spatial import ConvexHull
+
+from ans_display_store import DisplayStore
+from ans_hull import SupportHull
 
 maxint = np.iinfo(np.int32).max
 
+# Slack on early aborts of placement, so that rounding never aborts a display that would pass.
+ABORT_MARGIN = 1e-9
+
 
 class Circle(object):
 
@@ -26,20 +32,7 @@ class Circle(object):
         self.x, self.y, self.radius = self.random_circle()
 
     def random_circle(self):
-
-        def euclidean_distance(x):
-            return np.sqrt(np.square(self.bounding_circle.center - x).sum())
-
-        while True:
-
-            center = np.empty(2)
-            center[0] = uniform(*self.bounding_circle.square[0])
-            center[1] = uniform(*self.bounding_circle.square[1])
-
-            radius = uniform(*self.radius_range)
-
-            if euclidean_distance(center) + radius < self.bounding_circle.radius:
-                return tuple(center) + (radius,)
+        return random_circle(self.radius_range, self.bounding_circle)
 
     @property
     def center(self):
@@ -79,6 +72,40 @@ class Circle(object):
         return np.pi * self.radius**2
 
 
+def random_circle(radius_range, bounding_circle):
+    '''
+    Sample a circle, with radius in `radius_range`, that lies inside
+    `bounding_circle`, using the global numpy random state.
+    '''
+
+    def euclidean_distance(x):
+        return np.sqrt(np.square(bounding_circle.center - x).sum())
+
+    while True:
+
+        center = np.empty(2)
+        center[0] = uniform(*bounding_circle.square[0])
+        center[1] = uniform(*bounding_circle.square[1])
+
+        radius = uniform(*radius_range)
+
+        if euclidean_distance(center) + radius < bounding_circle.radius:
+            return tuple(center) + (radius,)
+
+
+def collision(circles, circle):
+    '''
+    Does `circle` collide with any of the (x, y, radius) rows of `circles`,
+    i.e. is the distance between them less than the sum of radii.
+    '''
+
+    x, y, radius = circle
+
+    distance = np.sqrt((x - circles[:, 0])**2 + (y - circles[:, 1])**2)
+
+    return bool(np.any(distance < radius + circles[:, 2]))
+
+
 class BoundingCircle(object):
 
     def __init__(self, x=0.0, y=0.0, radius=1.0):
@@ -114,6 +141,41 @@ def polar2cartesian(rho, phi):
     return x, y
 
 
+def perimeter_points(circles):
+    '''
+    The 360 perimeter points, one per degree, of each (x, y, radius) row of
+    `circles`, as a (360 K, 2) array.
+    '''
+
+    phi = np.radians(np.arange(360))
+    offset_x, offset_y = polar2cartesian(circles[:, 2:3], phi)
+
+    return np.stack((circles[:, 0:1] + offset_x,
+                     circles[:, 1:2] + offset_y), axis=-1).reshape(-1, 2)
+
+
+def display_uid(seed, radius_range, K, bounding_circle):
+    '''
+    The uid of a random dot display: the first 7 characters of the sha1 of
+    its seed and parameters.
+    '''
+
+    # If seed is None, then use a random number in uid
+    if seed is None:
+        _seed = rand()
+    else:
+        _seed = seed
+
+    _uid = '_'.join(map(str,
+                        [_seed,
+                         radius_range,
+                         K,
+                         bounding_circle.center,
+                         bounding_circle.radius]))
+
+    return checksum(_uid.encode('utf-8'))[:7]
+
+
 class RandomDotDisplay:
 
     """
@@ -123,7 +185,7 @@ class RandomDotDisplay:
 
     maxint = np.iinfo(np.int32).max
 
-    def __init__(self, K, radius_range=[0.05, 0.1], bounding_circle=None, seed=None):
+    def __init__(self, K, radius_range=[0.05, 0.1], bounding_circle=None, seed=None, generate=True):
 
         self.seed = seed
         self._random = np.random.RandomState(self.seed)
@@ -139,24 +201,15 @@ class RandomDotDisplay:
 
         self.uid = self.make_uid()
 
-        self.generate()
-
-    def make_uid(self):
+        # With generate=False, the uid is known but the circles are only placed by calling generate()
+        self.circles = None
+        self._convex_hull = None
 
-        # If seed is None, then use a random number in uid
-        if self.seed is None:
-            _seed = rand()
-        else:
-            _seed = self.seed
+        if generate:
+            self.generate()
 
-        _uid = '_'.join(map(str,
-                            [_seed,
-                             self.radius_range,
-                             self.K,
-                             self.bounding_circle.center,
-                             self.bounding_circle.radius]))
-
-        return checksum(_uid.encode('utf-8'))[:7]
+    def make_uid(self):
+        return display_uid(self.seed, self.radius_range, self.K, self.bounding_circle)
 
     def generate_seed(self):
 
@@ -169,33 +222,85 @@ class RandomDotDisplay:
 
         return _randint
 
-    def generate(self):
+    def generate(self, density_window=None, hull_window=None):
+        '''
+        Place the K circles, as the rows (x, y, radius) of `self.circles`.
+
+        Given a density or convex hull proportion window (target, half width),
+        placement is aborted as soon as the circles placed so far rule the
+        window out, leaving `self.circles` None and returning False. Both
+        metrics only grow as circles are added: the density is bounded by
+        the areas placed so far and the radius range of the rest, and the
+        hull area from below by the hull maintained as each circle is placed.
+        '''
 
-        circles = []
+        circles = np.empty((self.K, 3))
+        k = 0
 
-        while len(circles) < self.K:
+        hull = SupportHull() if hull_window else None
+        area = 0.0
+
+        self.circles = None
+        self._convex_hull = None
+
+        while k < self.K:
 
             seed = self.generate_seed()
 
-            circle = Circle(self.radius_range, self.bounding_circle, seed)
+            if seed:
+                np.random.seed(seed)
+
+            circle = random_circle(self.radius_range, self.bounding_circle)
+
+            if not collision(circles[:k], circle):
+                circles[k] = circle
+                k += 1
 
-            if not any([circle.collision(other_circle) for other_circle in circles]):
-                circles.append(circle)
+                if density_window:
+                    area += np.pi * circle[2]**2
+                    if not self._density_reachable(area, self.K - k, density_window):
+                        return False
+
+                if hull_window:
+                    hull.add(circle)
+                    if hull.area / self.bounding_circle.area >= sum(hull_window) + ABORT_MARGIN:
+                        return False
 
         self.circles = circles
 
+        return True
+
+    def _density_reachable(self, area, remaining, density_window):
+        '''
+        Can the density end up in `density_window`, with circles of total
+        `area` placed and `remaining` circles to place.
+        '''
+
+        target, eps = density_window
+        low, high = self.radius_range
+
+        smallest = (area + remaining * np.pi * low**2) / self.bounding_circle.area
+        largest = (area + remaining * np.pi * high**2) / self.bounding_circle.area
+
+        return smallest < target + eps + ABORT_MARGIN and largest > target - eps - ABORT_MARGIN
+
     @property
     def centers(self):
-        return [circle.center for circle in self.circles]
+        return self.circles[:, :2]
 
     @property
     def perimeter_points(self):
-        return np.vstack([circle.perimeter_points for circle in self.circles])
+        return perimeter_points(self.circles)
 
     @property
     def convex_hull(self):
 
-        return ConvexHull(self.perimeter_points)
+        if self._convex_hull is None:
+            # scipy is only imported by the commands that compute a hull
+            from scipy.spatial import ConvexHull
+            self._convex_hull = ConvexHull(self.perimeter_points)
+
+        return self._convex_hull
 
     @property
     def convex_hull_area(self):
@@ -207,7 +312,8 @@ class RandomDotDisplay:
 
     @property
     def density(self):
-        return sum([circle.area for circle in self.circles]) / self.bounding_circle.area
+        # summed in order, as the areas of the individual circles were
+        return sum(np.pi * self.circles[:, 2]**2) / self.bounding_circle.area
     
     @property
     def convex_hull_vertices(self):
@@ -220,15 +326,17 @@ class RandomDotDisplay:
 
     def plot(self, show_hull=False, width=6, height=6, alpha=0.2, background_colour='red'):
 
+        from matplotlib import pyplot
+
         fig = pyplot.figure(figsize=(width, height))
 
         ax = pyplot.gca()
         ax.set_xlim(self.bounding_circle.square[0])
         ax.set_ylim(self.bounding_circle.square[1])
 
-        for circle in self.circles:
+        for x, y, radius in self.circles:
             circle_patch = pyplot.Circle(
-                circle.center, circle.radius, color='blue')
+                (x, y), radius, color='blue')
             ax.add_artist(circle_patch)
 
         circle = pyplot.Circle(self.bounding_circle.center,
@@ -249,23 +357,30 @@ class RandomDotDisplay:
     @classmethod
     def create(cls, **kwargs):
 
-        random_dot_display = cls(**kwargs)
+        return cls(**kwargs).as_dict()
+
+    def as_dict(self):
+        return display_dict(self.uid, self.seed, self.bounding_circle, self.radius_range, self.circles,
+                            self.convex_hull_area, self.density)
+
 
-        D = OrderedDict()
+def display_dict(uid, seed, bounding_circle, radius_range, circles, convex_hull_proportion, density):
 
-        D['uid'] = random_dot_display.uid
-        D['seed'] = random_dot_display.seed
-        D['bounding_circle_parameters'] = random_dot_display.bounding_circle.parameters
-        D['bounding_circle_area'] = random_dot_display.bounding_circle.area
+    D = OrderedDict()
 
-        D['number_of_circles'] = len(random_dot_display.circles)
-        D['radius_range'] = random_dot_display.radius_range
-        D['convex_hull_proportion'] = random_dot_display.convex_hull_area
-        D['density'] = random_dot_display.density
+    D['uid'] = uid
+    D['seed'] = seed
+    D['bounding_circle_parameters'] = bounding_circle.parameters
+    D['bounding_circle_area'] = bounding_circle.area
 
-        D['circles'] = [circle.parameters for circle in random_dot_display.circles]
+    D['number_of_circles'] = len(circles)
+    D['radius_range'] = radius_range
+    D['convex_hull_proportion'] = convex_hull_proportion
+    D['density'] = density
 
-        return D
+    D['circles'] = circles.tolist()
+
+    return D
 
 
 def make_random_dot_displays(N,
@@ -320,7 +435,7 @@ def make_blob_display_stimuli(N, number_of_dots_range=(12, 13), radius_range=(0.
 
         seed_circle = _random.randint(maxint)
 
-        return RandomDotDisplay(K=K, radius_range=radius_range, seed=seed_circle)
+        return RandomDotDisplay(K=K, radius_range=radius_range, seed=seed_circle, generate=False)
     
     stimuli = {}
     displays = {}
@@ -329,12 +444,15 @@ def make_blob_display_stimuli(N, number_of_dots_range=(12, 13), radius_range=(0.
 
         left_blob, right_blob = sample_display(), sample_display()
 
-        # areas to the left and right should be different
-        if left_blob.convex_hull_area == right_blob.convex_hull_area:
+        # don't repeat pairs already collected, checked before placing any circles
+        if (left_blob.uid, right_blob.uid) in stimuli:
             continue
 
-        # don't repeat pairs already collected
-        if (left_blob.uid, right_blob.uid) in stimuli:
+        left_blob.generate()
+        right_blob.generate()
+
+        # areas to the left and right should be different
+        if left_blob.convex_hull_area == right_blob.convex_hull_area:
             continue
 
         stimuli[(left_blob.uid, right_blob.uid)] = None
@@ -344,52 +462,223 @@ def make_blob_display_stimuli(N, number_of_dots_range=(12, 13), radius_range=(0.
     return dict(stimuli = list(stimuli.keys()), displays = displays)    
 
 
-def make_dot_display_stimuli(N, number_of_dots_range=(40, 60), radius_range=(0.05, 0.1), seed=None):
+class PairPipeline(object):
+
+    """
+    Accept or reject candidate pairs of random dot displays with checks
+    ordered by cost, so that no placement or hull work is spent on a pair
+    that a cheaper check rejects:
+
+     1. number: the numbers of circles of the two displays differ.
+     2. density_bounds: the density window of each display is reachable
+        with its number of circles and radius range.
+     3. duplicate: the pair of uids, known before placement, is new.
+     4. uid_collision: no display was accepted before with the uid of a
+        display of the pair but a different seed or number of circles.
+     5. placement: the circles are placed, aborting as soon as the circles
+        placed so far rule out the density or hull window.
+     6. density: the density of each display is in its window.
+     7. hull: the convex hull proportion of each display is in its window.
+     8. near_duplicate: no display accepted before looks almost the same as
+        a display of the pair.
+
+    Windows are (target, half width), or None to not filter on that metric.
+    `duplicates` is an `ans_dedup.DuplicateIndex` of the accepted displays,
+    or None to not check uid collisions and near duplicates.
+    The number of calls, rejections and seconds spent in each stage are
+    accumulated in `stats`.
+    """
+
+    STAGES = ('number', 'density_bounds', 'duplicate', 'uid_collision', 'placement', 'density', 'hull',
+              'near_duplicate')
+
+    def __init__(self, density_window=None, hull_window=None, stages=STAGES, early_abort=True, duplicates=None):
+
+        self.density_window = density_window
+        self.hull_window = hull_window
+        self.duplicates = duplicates
+        self.stages = stages
+        self.early_abort = early_abort
+
+        self.stats = OrderedDict((stage, dict(calls=0, rejected=0, seconds=0.0)) for stage in stages)
+
+    def __call__(self, K, seeds, radius_range, stimuli):
+        """
+        Run the candidate pair with numbers of circles `K` and display seeds
+        `seeds` through the stages. Returns its two placed RandomDotDisplays,
+        or None if it is rejected.
+        """
+
+        candidate = dict(K=K, seeds=seeds, radius_range=radius_range, displays=None, placed=None,
+                         fingerprints=None)
+
+        for stage in self.stages:
+
+            stats = self.stats[stage]
+
+            start = time.perf_counter()
+            accepted = getattr(self, '_' + stage)(candidate, stimuli)
+            stats['seconds'] += time.perf_counter() - start
+            stats['calls'] += 1
+
+            if not accepted:
+                stats['rejected'] += 1
+                return None
+
+        displays = self._placed(candidate)
+
+        if self.duplicates is not None:
+            for display, fingerprint in zip(displays, self._fingerprints(candidate)):
+                self.duplicates.add(display.uid, (display.seed, display.K), fingerprint)
+
+        return displays
+
+    @staticmethod
+    def _in_window(value, window):
+        return window is None or abs(value - window[0]) < window[1]
+
+    def _displays(self, candidate):
+
+        if candidate['displays'] is None:
+            candidate['displays'] = [RandomDotDisplay(K=K, radius_range=candidate['radius_range'], seed=seed,
+                                                      generate=False)
+                                     for K, seed in zip(candidate['K'], candidate['seeds'])]
+
+        return candidate['displays']
+
+    def _placed(self, candidate):
+        '''
+        The displays of the candidate with their circles placed, or None if
+        placement of one of them was aborted.
+        '''
+
+        displays = self._displays(candidate)
+
+        if candidate['placed'] is None:
+
+            windows = dict(density_window=self.density_window,
+                           hull_window=self.hull_window) if self.early_abort else {}
+
+            # the right display is not placed if placement of the left one was aborted
+            candidate['placed'] = all(display.generate(**windows) for display in displays)
+
+        return displays if candidate['placed'] else None
+
+    def _number(self, candidate, stimuli):
+        return candidate['K'][0] != candidate['K'][1]
+
+    def _density_bounds(self, candidate, stimuli):
+
+        if self.density_window is None:
+            return True
+
+        target, eps = self.density_window
+        low, high = candidate['radius_range']
+        area = BoundingCircle().area
+
+        return all(K * np.pi * low**2 / area < target + eps and K * np.pi * high**2 / area > target - eps
+                   for K in candidate['K'])
+
+    def _duplicate(self, candidate, stimuli):
+        left, right = self._displays(candidate)
+        return (left.uid, right.uid) not in stimuli
+
+    def _fingerprints(self, candidate):
+
+        if candidate['fingerprints'] is None:
+            candidate['fingerprints'] = [self.duplicates.fingerprint(display.circles)
+                                         for display in self._placed(candidate)]
+
+        return candidate['fingerprints']
+
+    def _uid_collision(self, candidate, stimuli):
+        return self.duplicates is None or not any(self.duplicates.uid_collision(display.uid, (display.seed, display.K))
+                                                  for display in self._displays(candidate))
+
+    def _placement(self, candidate, stimuli):
+        return self._placed(candidate) is not None
+
+    def _density(self, candidate, stimuli):
+        displays = self._placed(candidate)
+        return displays is not None and all(self._in_window(display.density, self.density_window)
+                                            for display in displays)
+
+    def _hull(self, candidate, stimuli):
+        displays = self._placed(candidate)
+        return displays is not None and all(self._in_window(display.convex_hull_area, self.hull_window)
+                                            for display in displays)
+
+    def _near_duplicate(self, candidate, stimuli):
+
+        if self.duplicates is None:
+            return True
+
+        displays = self._placed(candidate)
+        if displays is None:
+            return False
+
+        return not any(self.duplicates.near_duplicates(display.uid, (display.seed, display.K), fingerprint)
+                       for display, fingerprint in zip(displays, self._fingerprints(candidate)))
+
+    def report(self):
+        "The stats of the stages as lines of text"
+
+        lines = ['%-15s %10s %10s %9s %10s' % ('stage', 'calls', 'rejected', 'seconds', 'ms/call')]
+        for stage, stats in self.stats.items():
+            lines.append('%-15s %10d %10d %9.3f %10.4f' % (stage, stats['calls'], stats['rejected'], stats['seconds'],
+                                                          1000 * stats['seconds'] / max(stats['calls'], 1)))
+
+        return '\n'.join(lines)
+
+
+def make_dot_display_stimuli(N, number_of_dots_range=(40, 60), radius_range=(0.05, 0.1), seed=None, as_store=False,
+                             pipeline=None):
     """
     Generate a set of N unique pairs of random dot displays.
+
+    Candidate pairs are accepted by `pipeline`, a PairPipeline, which by
+    default only requires different numbers of circles and new uid pairs.
+    The displays are collected in a DisplayStore, which is returned as is if
+    `as_store`, or else as the uid keyed dict of the stimuli files.
     """
 
     _random = np.random.RandomState(seed)
 
+    if pipeline is None:
+        pipeline = PairPipeline()
+
     def sample_display():
 
         K = _random.randint(*number_of_dots_range)
 
         seed_circle = _random.randint(maxint)
 
-        return RandomDotDisplay.create(K=K, radius_range=radius_range, seed=seed_circle)
+        return K, seed_circle
 
-    def display_filter(display, eps=0.01, convex_threshold=0.86, density_threshold=0.38):
-
-        a = abs(display['convex_hull_proportion'] - convex_threshold) < eps/2
-        b = abs(display['density'] - density_threshold) < eps
-
-        return a and b
-    
     stimuli = {}
-    displays = {}
+    displays = DisplayStore(capacity=2 * N)
+    uids = set()
 
     while len(stimuli) < N:
 
-        left, right = sample_display(), sample_display()
+        (K_left, seed_left), (K_right, seed_right) = sample_display(), sample_display()
 
-        # numbers to the left and right should be different
-        if left['number_of_circles'] == right['number_of_circles']:
+        accepted = pipeline((K_left, K_right), (seed_left, seed_right), radius_range, stimuli)
+        if accepted is None:
             continue
 
-        # we need both displays to have similar densities and hull proportions
-        if not display_filter(left) and display_filter(right):
-            continue
-
-        # don't repeat pairs already collected
-        if (left['uid'], right['uid']) in stimuli:
-            continue
+        stimuli[tuple(display.uid for display in accepted)] = None
 
-        uid_left, uid_right = left.pop('uid'), right.pop('uid')
+        # the circle arrays and metrics go straight into the store
+        for display in accepted:
+            if display.uid not in uids:
+                uids.add(display.uid)
+                displays.append(display.uid, display.seed, display.circles, display.density,
+                                display.convex_hull_area, display.bounding_circle.parameters,
+                                display.radius_range)
 
-        stimuli[(uid_left, uid_right)] = None
-        displays[uid_left] = left
-        displays[uid_right] = right
+    if not as_store:
+        displays = displays.to_displays()
 
     return dict(stimuli = list(stimuli.keys()), displays = displays)
 
@@ -397,8 +686,9 @@ def make_dot_display_stimuli(N, number_of_dots_range=(40, 60), radius_range=(0.0
 if __name__ == '__main__':
 
 
-    import json
     import argparse
+    from ans_stimuli_file import write_stimuli
+    from ans_dedup import DuplicateIndex, MAX_DISTANCE
     parser = argparse.ArgumentParser(prog='generate_ans_stimuli',
                                      description='Generate a json file of stimuli for an ANS task.')
     
@@ -406,19 +696,31 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--number', dest='number', default=10, type=int, required=False, help = 'The number of stimuli to generate (default: 10).')
     parser.add_argument('-s', '--seed', required=False, default=None, type=int, help='The seed for the random number generator (default: None).')
     parser.add_argument('-f', '--filename', default='stimuli.json', required=False, help='The json filename (default: stimuli.json)')
+    parser.add_argument('--density-window', dest='density_window', nargs=2, type=float, default=None, metavar=('TARGET', 'EPS'), required=False, help='Only accept dot displays with density within EPS of TARGET (default: no filter).')
+    parser.add_argument('--hull-window', dest='hull_window', nargs=2, type=float, default=None, metavar=('TARGET', 'EPS'), required=False, help='Only accept dot displays with convex hull proportion within EPS of TARGET (default: no filter).')
+    parser.add_argument('--reject-duplicates', dest='reject_duplicates', nargs='?', type=float, const=MAX_DISTANCE, default=None, metavar='MAX_DISTANCE', required=False, help='Reject dot displays whose uid collides with, or which differ in at most MAX_DISTANCE (default: %g) of the cells of their occupancy fingerprint from, a display accepted before (default: no check).' % MAX_DISTANCE)
+    parser.add_argument('--stage-report', dest='stage_report', action='store_true', help='Print the calls, rejections and time of each stage of dot pair generation.')
 
     args = parser.parse_args()
-    
+
+    duplicates = None
+    if args.reject_duplicates is not None:
+        duplicates = DuplicateIndex(max_distance=args.reject_duplicates)
+
+    pipeline = PairPipeline(density_window=args.density_window, hull_window=args.hull_window, duplicates=duplicates)
+
     block_stimuli = []
     for block in range(args.blocks):
-        dot_stimuli = make_dot_display_stimuli(N = args.number, seed=args.seed)
+        dot_stimuli = make_dot_display_stimuli(N = args.number, seed=args.seed, pipeline=pipeline)
         blob_stimuli = make_blob_display_stimuli(N = args.number, seed=args.seed)
 
         stimuli = dict(dots = dot_stimuli, blobs = blob_stimuli)
 
         block_stimuli.append(stimuli)
 
-    with open(args.filename, 'w') as f:
-        json.dump(block_stimuli, f, indent=4)
+    write_stimuli(block_stimuli, args.filename)
+
+    if args.stage_report:
+        print(pipeline.report())
 
     
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+Preview contact sheets of the pairs of an ANS task stimuli file.
+
+Every pair of dots or blobs displays is drawn side by side, laid out as in
+the task, and labelled with its uids and metrics. The pairs are paginated
+into PNG contact sheets, rendered headless with the Agg backend, one
+collection per sheet for all circles or polygons, with the pages spread
+across a process pool.
+
+    python preview_ans_stimuli.py stimuli_4_5_1010101.json -o previews
+"""
+
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from ans_display_store import DisplayStore
+from qa_ans_stimuli import load_stimuli
+
+# Display centres and scales in units of a quarter of the window width, as in ans_task.py
+LEFT_CENTRE, RIGHT_CENTRE = -1.0, 1.0
+DOT_SCALE, BLOB_SCALE = 0.8, 1.0
+
+COLUMNS = 4
+ROWS = 6
+
+# Size of one pair panel in inches, and resolution of the sheets
+PANEL_WIDTH, PANEL_HEIGHT = 3.3, 2.55
+DPI = 100
+
+
+def dot_pairs(blocks_stimuli):
+    "The pairs of dot displays as (label, left circles, right circles), in order"
+
+    pairs = []
+    for k, block_stimuli in enumerate(blocks_stimuli):
+
+        store = DisplayStore.from_displays(block_stimuli['dots']['displays'])
+
+        for i, (left_uid, right_uid) in enumerate(block_stimuli['dots']['stimuli']):
+
+            left, right = store.row(left_uid), store.row(right_uid)
+
+            label = ('B%d #%d  %s | %s\nK %d | %d  density %.3f | %.3f\nhull %.3f | %.3f'
+                     % (k + 1, i + 1, left_uid, right_uid,
+                        store.K[left], store.K[right],
+                        store.density[left], store.density[right],
+                        store.convex_hull_proportion[left], store.convex_hull_proportion[right]))
+
+            pairs.append((label, store.circles_of(left), store.circles_of(right)))
+
+    return pairs
+
+
+def blob_pairs(blocks_stimuli):
+    "The pairs of blob displays as (label, left vertices, right vertices), in order"
+
+    pairs = []
+    for k, block_stimuli in enumerate(blocks_stimuli):
+
+        displays = block_stimuli['blobs']['displays']
+
+        for i, (left_uid, right_uid) in enumerate(block_stimuli['blobs']['stimuli']):
+
+            left, right = displays[left_uid], displays[right_uid]
+
+            label = ('B%d #%d  %s | %s\narea %.3f | %.3f  ratio %.3f'
+                     % (k + 1, i + 1, left_uid, right_uid, left['area'], right['area'],
+                        max(left['area'], right['area']) / min(left['area'], right['area'])))
+
+            pairs.append((label, np.array(left['vertices']), np.array(right['vertices'])))
+
+    return pairs
+
+
+def render_page(args):
+    """
+    Render one contact sheet of pairs to the PNG file `filename`.
+
+    The whole sheet is one axes: each pair panel is offset in data
+    coordinates, and all circles (or polygons) and panel frames of the sheet
+    are drawn as single collections.
+    """
+
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import EllipseCollection, PolyCollection
+
+    filename, kind, title, pairs = args
+
+    rows = int(np.ceil(len(pairs) / COLUMNS))
+
+    figure = Figure(figsize=(COLUMNS * PANEL_WIDTH, rows * PANEL_HEIGHT + 0.3), dpi=DPI)
+    FigureCanvasAgg(figure)
+    figure.suptitle(title, fontsize=10, y=1 - 0.1 / figure.get_figheight())
+
+    ax = figure.add_axes((0, 0, 1, 1 - 0.3 / figure.get_figheight()))
+    ax.set_axis_off()
+
+    # a panel is 4.4 x 3.4 in data units: the [-2, 2] x [-1.1, 1.1] pair, a margin and a label
+    panel_width, panel_height = 4.4, 3.4
+    ax.set_xlim(0, COLUMNS * panel_width)
+    ax.set_ylim(-rows * panel_height, 0)
+
+    centres = np.array([((i % COLUMNS + 0.5) * panel_width, -(i // COLUMNS + 0.6) * panel_height)
+                        for i in range(len(pairs))]).reshape(-1, 2)
+
+    frame = np.array([[-2, -1.1], [2, -1.1], [2, 1.1], [-2, 1.1]])
+    ax.add_collection(PolyCollection([frame + centre for centre in centres],
+                                     facecolors='none', edgecolors='0.6', linewidths=0.5))
+
+    for (label, _, _), (x, y) in zip(pairs, centres):
+        ax.text(x - 2, y + 1.2, label, fontsize=6, family='monospace', va='bottom')
+
+    if kind == 'dots':
+
+        circles = np.vstack([np.vstack((left * DOT_SCALE + [x + LEFT_CENTRE, y, 0],
+                                        right * DOT_SCALE + [x + RIGHT_CENTRE, y, 0]))
+                             for (_, left, right), (x, y) in zip(pairs, centres)])
+
+        ax.add_collection(EllipseCollection(2 * circles[:, 2], 2 * circles[:, 2], 0, units='xy',
+                                            offsets=circles[:, :2], offset_transform=ax.transData,
+                                            facecolors='black', edgecolors='none'))
+    else:
+
+        polygons = []
+        for (_, left, right), (x, y) in zip(pairs, centres):
+            polygons.append(left * BLOB_SCALE + [x + LEFT_CENTRE, y])
+            polygons.append(right * BLOB_SCALE + [x + RIGHT_CENTRE, y])
+
+        ax.add_collection(PolyCollection(polygons, facecolors='black', edgecolors='none'))
+
+    figure.savefig(filename)
+
+    return filename
+
+
+def preview(blocks_stimuli, output_dir, name='stimuli', kinds=('dots', 'blobs'),
+            per_page=COLUMNS * ROWS, processes=None):
+    "Render the contact sheets of the pairs of `kinds` and return their filenames"
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    pages = []
+    for kind in kinds:
+
+        pairs = dot_pairs(blocks_stimuli) if kind == 'dots' else blob_pairs(blocks_stimuli)
+        n_pages = int(np.ceil(len(pairs) / per_page))
+
+        for page in range(n_pages):
+            filename = os.path.join(output_dir, '%s_%s_%03d.png' % (name, kind, page + 1))
+            title = '%s: %s, page %d of %d' % (name, kind, page + 1, n_pages)
+            pages.append((filename, kind, title, pairs[page * per_page:(page + 1) * per_page]))
+
+    if processes == 1 or len(pages) < 2:
+        return list(map(render_page, pages))
+
+    with Pool(processes) as pool:
+        return pool.map(render_page, pages)
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(prog='preview_ans_stimuli',
+                                     description='Render PNG contact sheets of the pairs of a json file of ANS task stimuli.')
+
+    parser.add_argument('filename', help='The json stimuli filename.')
+    parser.add_argument('-o', '--output-dir', dest='output_dir', default=None, required=False,
+                        help='The directory of the sheets (default: <filename>_preview).')
+    parser.add_argument('-k', '--kind', choices=['dots', 'blobs', 'both'], default='both', required=False,
+                        help='Which pairs to preview (default: both).')
+    parser.add_argument('-n', '--per-page', dest='per_page', default=COLUMNS * ROWS, type=int, required=False,
+                        help='The number of pairs per sheet (default: %d).' % (COLUMNS * ROWS))
+    parser.add_argument('-p', '--processes', default=os.cpu_count(), type=int, required=False,
+                        help='The number of worker processes (default: number of cores).')
+
+    args = parser.parse_args()
+
+    name = os.path.splitext(os.path.basename(args.filename))[0]
+    output_dir = args.output_dir or os.path.splitext(args.filename)[0] + '_preview'
+    kinds = ('dots', 'blobs') if args.kind == 'both' else (args.kind,)
+
+    filenames = preview(load_stimuli(args.filename), output_dir, name=name, kinds=kinds,
+                        per_page=args.per_page, processes=args.processes)
+
+    print('Wrote %d sheets to %s' % (len(filenames), output_dir))
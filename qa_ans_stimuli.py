@@ -0,0 +1,436 @@
+"""
+Quality assurance report for an ANS task stimuli file.
+
+All displays in the file are flattened into arrays, and the validity checks,
+metric distributions and non-numerical cue statistics are computed vectorized
+across every display at once, spread across a process pool for large files.
+
+    python qa_ans_stimuli.py stimuli_4_5_1010101.json -o stimuli_4_5_1010101_qa.json
+"""
+
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from ans_hull import hull_areas
+from ans_stimuli_file import read_stimuli
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+# Number of support directions used to recompute convex hull areas.
+HULL_DIRECTIONS = 720
+
+# Number of displays checked per vectorized chunk.
+CHUNK_SIZE = 256
+
+# Chunks below this number of displays are checked in this process.
+MIN_PARALLEL_DISPLAYS = 4 * CHUNK_SIZE
+
+
+def load_stimuli(filename):
+    "Load an ANS task stimuli file, of either format version"
+    return read_stimuli(filename, loads=json.loads)
+
+
+def _pairs_to_rows(block_stimuli, rows):
+    return [(rows[left_uid], rows[right_uid]) for left_uid, right_uid in block_stimuli['stimuli']]
+
+
+def dot_arrays(blocks_stimuli):
+    """
+    Flatten the dot displays of every block into arrays.
+
+    Each display is one row. The circles of row i are
+    circles[offsets[i]:offsets[i + 1]], and pairs holds the row indices of
+    the left and right display of every trial.
+    """
+
+    uids, blocks, seeds = [], [], []
+    K, density, hull_proportion = [], [], []
+    bounding_circle, bounding_circle_area = [], []
+    circles, counts, pairs, pair_blocks = [], [], [], []
+
+    for k, block_stimuli in enumerate(blocks_stimuli):
+
+        dots = block_stimuli['dots']
+        rows = {}
+
+        for uid, display in dots['displays'].items():
+            rows[uid] = len(uids)
+            uids.append(uid)
+            blocks.append(k)
+            seeds.append(display['seed'])
+            K.append(display['number_of_circles'])
+            density.append(display['density'])
+            hull_proportion.append(display['convex_hull_proportion'])
+            bounding_circle.append(display['bounding_circle_parameters'])
+            bounding_circle_area.append(display['bounding_circle_area'])
+            counts.append(len(display['circles']))
+            circles.extend(display['circles'])
+
+        block_pairs = _pairs_to_rows(dots, rows)
+        pairs.extend(block_pairs)
+        pair_blocks.extend([k] * len(block_pairs))
+
+    counts = np.array(counts, dtype=np.int64)
+
+    return dict(uid=np.array(uids, dtype='U7'),
+                block=np.array(blocks, dtype=np.int64),
+                seed=np.array(seeds, dtype=np.int64),
+                K=np.array(K, dtype=np.int64),
+                density=np.array(density, dtype=np.float64),
+                convex_hull_proportion=np.array(hull_proportion, dtype=np.float64),
+                bounding_circle=np.array(bounding_circle, dtype=np.float64).reshape(-1, 3),
+                bounding_circle_area=np.array(bounding_circle_area, dtype=np.float64),
+                offsets=np.concatenate(([0], np.cumsum(counts))),
+                circles=np.array(circles, dtype=np.float64).reshape(-1, 3),
+                pairs=np.array(pairs, dtype=np.int64).reshape(-1, 2),
+                pair_block=np.array(pair_blocks, dtype=np.int64))
+
+
+def blob_arrays(blocks_stimuli):
+    """
+    Flatten the blob displays of every block into arrays.
+
+    The polygon of row i is vertices[offsets[i]:offsets[i + 1]].
+    """
+
+    uids, blocks, area, counts = [], [], [], []
+    vertices, pairs, pair_blocks = [], [], []
+
+    for k, block_stimuli in enumerate(blocks_stimuli):
+
+        blobs = block_stimuli['blobs']
+        rows = {}
+
+        for uid, display in blobs['displays'].items():
+            rows[uid] = len(uids)
+            uids.append(uid)
+            blocks.append(k)
+            area.append(display['area'])
+            counts.append(len(display['vertices']))
+            vertices.extend(display['vertices'])
+
+        block_pairs = _pairs_to_rows(blobs, rows)
+        pairs.extend(block_pairs)
+        pair_blocks.extend([k] * len(block_pairs))
+
+    counts = np.array(counts, dtype=np.int64)
+
+    return dict(uid=np.array(uids, dtype='U7'),
+                block=np.array(blocks, dtype=np.int64),
+                area=np.array(area, dtype=np.float64),
+                offsets=np.concatenate(([0], np.cumsum(counts))),
+                vertices=np.array(vertices, dtype=np.float64).reshape(-1, 2),
+                pairs=np.array(pairs, dtype=np.int64).reshape(-1, 2),
+                pair_block=np.array(pair_blocks, dtype=np.int64))
+
+
+def pad(values, offsets):
+    """
+    Scatter ragged rows values[offsets[i]:offsets[i + 1]] into a zero padded
+    (rows, longest row, columns) array, and return it with its validity mask.
+    """
+
+    counts = np.diff(offsets)
+    n, width = len(counts), (counts.max() if len(counts) else 0)
+
+    row = np.repeat(np.arange(n), counts)
+    column = np.arange(len(values)) - np.repeat(offsets[:-1], counts)
+
+    padded = np.zeros((n, width, values.shape[1]))
+    mask = np.zeros((n, width), dtype=bool)
+
+    padded[row, column] = values
+    mask[row, column] = True
+
+    return padded, mask
+
+
+def _dot_checks_chunk(args):
+
+    circles, mask, bounding_circle = args
+
+    x, y, r = circles[..., 0], circles[..., 1], circles[..., 2]
+
+    # circles overlap if the distance between them is less than the sum of radii
+    distance = np.sqrt((x[:, :, None] - x[:, None, :])**2 + (y[:, :, None] - y[:, None, :])**2)
+    overlap = distance < r[:, :, None] + r[:, None, :]
+    overlap &= mask[:, :, None] & mask[:, None, :]
+    overlap &= np.triu(np.ones(overlap.shape[1:], dtype=bool), k=1)
+
+    # circles must lie strictly inside the bounding circle
+    centre_distance = np.sqrt((x - bounding_circle[:, None, 0])**2 + (y - bounding_circle[:, None, 1])**2)
+    outside = (centre_distance + r >= bounding_circle[:, None, 2]) & mask
+
+    return overlap.sum(axis=(1, 2)), outside.sum(axis=1), hull_areas(circles, mask, HULL_DIRECTIONS)
+
+
+def _chunks(n, size):
+    return [slice(i, min(i + size, n)) for i in range(0, n, size)]
+
+
+def dot_checks(arrays, processes=None):
+    """
+    Count overlapping circle pairs and circles outside the bounding circle,
+    and recompute the convex hull area, for every dot display.
+    """
+
+    circles, mask = pad(arrays['circles'], arrays['offsets'])
+    bounding_circle = arrays['bounding_circle']
+
+    chunks = [(circles[s], mask[s], bounding_circle[s]) for s in _chunks(len(circles), CHUNK_SIZE)]
+
+    if processes == 1 or len(circles) < MIN_PARALLEL_DISPLAYS:
+        results = list(map(_dot_checks_chunk, chunks))
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_dot_checks_chunk, chunks)
+
+    if not results:
+        return dict(overlaps=np.zeros(0, np.int64), outside=np.zeros(0, np.int64), hull_area=np.zeros(0))
+
+    overlaps, outside, hull_area = map(np.concatenate, zip(*results))
+
+    return dict(overlaps=overlaps, outside=outside, hull_area=hull_area)
+
+
+def polygon_areas_and_perimeters(vertices, offsets):
+    "Shoelace areas and perimeters of closed ragged polygons"
+
+    starts = offsets[:-1]
+    following = np.roll(vertices, -1, axis=0)
+
+    # wrap the last vertex of every polygon around to its first one
+    following[offsets[1:] - 1] = vertices[starts]
+
+    x, y = vertices[:, 0], vertices[:, 1]
+    cross = x * following[:, 1] - following[:, 0] * y
+    edges = np.sqrt(np.square(following - vertices).sum(axis=1))
+
+    return 0.5 * np.add.reduceat(cross, starts), np.add.reduceat(edges, starts)
+
+
+def summarize(values):
+    "Compact summary of the distribution of `values`"
+
+    values = np.asarray(values, dtype=np.float64)
+
+    if len(values) == 0:
+        return dict(n=0)
+
+    quantiles = np.quantile(values, [0.0, 0.05, 0.25, 0.5, 0.75, 0.95, 1.0])
+
+    return dict(n=int(len(values)),
+                mean=float(values.mean()),
+                sd=float(values.std()),
+                quantiles=dict(zip(['min', 'q05', 'q25', 'median', 'q75', 'q95', 'max'],
+                                   map(float, quantiles))))
+
+
+def correlation(x, y):
+    "Pearson correlation, or None if either variable is constant"
+
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+    if len(x) < 2 or x.std() == 0 or y.std() == 0:
+        return None
+
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+def pair_ratios(values, pairs):
+    "Ratio of larger to smaller value, and whether the left is the larger, per pair"
+
+    left, right = values[pairs[:, 0]], values[pairs[:, 1]]
+
+    return np.maximum(left, right) / np.minimum(left, right), left > right
+
+
+def repeated_pairs(uids, pairs):
+    "Number of trials whose (left, right) uid pair also appears in an earlier trial"
+
+    keys = np.char.add(np.char.add(uids[pairs[:, 0]], '_'), uids[pairs[:, 1]])
+
+    return int(len(keys) - len(np.unique(keys)))
+
+
+def dot_cues(arrays, hull_area):
+    """
+    Non-numerical cues of every dot display: total surface area, total
+    perimeter, mean item area and field area (area of the convex hull).
+    """
+
+    starts = arrays['offsets'][:-1]
+    r = arrays['circles'][:, 2]
+
+    total_area = np.add.reduceat(np.pi * r**2, starts) if len(r) else np.zeros(0)
+    total_perimeter = np.add.reduceat(2 * np.pi * r, starts) if len(r) else np.zeros(0)
+
+    return dict(total_area=total_area,
+                total_perimeter=total_perimeter,
+                mean_item_area=total_area / arrays['K'],
+                field_area=hull_area)
+
+
+def cue_report(numerosity, cues, pairs):
+    """
+    Relation of each non-numerical cue to numerosity, both across displays
+    (log cue against log numerosity) and across trials (log ratio of cue
+    against log ratio of numerosity, right over left).
+    """
+
+    log_n = np.log(numerosity)
+    log_ratio_n = log_n[pairs[:, 1]] - log_n[pairs[:, 0]]
+
+    report = {}
+    for name, cue in cues.items():
+
+        log_cue = np.log(cue)
+        log_ratio_cue = log_cue[pairs[:, 1]] - log_cue[pairs[:, 0]]
+
+        report[name] = dict(distribution=summarize(cue),
+                            display_correlation=correlation(log_n, log_cue),
+                            pair_correlation=correlation(log_ratio_n, log_ratio_cue),
+                            congruent_proportion=(float(np.mean(np.sign(log_ratio_cue) == np.sign(log_ratio_n)))
+                                                  if len(pairs) else None))
+
+    return report
+
+
+def in_window(values, target, eps):
+    return float(np.mean(np.abs(values - target) < eps)) if len(values) else None
+
+
+def dot_report(arrays, processes=None, hull_target=(0.86, 0.005), density_target=(0.38, 0.01),
+               hull_tolerance=1e-3, density_tolerance=1e-9):
+
+    checks = dot_checks(arrays, processes=processes)
+
+    cues = dot_cues(arrays, checks['hull_area'])
+
+    density = cues['total_area'] / arrays['bounding_circle_area']
+    hull_proportion = checks['hull_area'] / arrays['bounding_circle_area']
+
+    density_error = np.abs(density - arrays['density'])
+    hull_error = np.abs(hull_proportion - arrays['convex_hull_proportion'])
+    count_error = arrays['K'] != np.diff(arrays['offsets'])
+
+    ratio, left_larger = pair_ratios(arrays['K'], arrays['pairs'])
+    area_ratio, _ = pair_ratios(cues['total_area'], arrays['pairs'])
+
+    return dict(displays=int(len(arrays['uid'])),
+                pairs=int(len(arrays['pairs'])),
+                repeated_pairs=repeated_pairs(arrays['uid'], arrays['pairs']),
+                checks=dict(overlapping_displays=int(np.count_nonzero(checks['overlaps'])),
+                            overlapping_circle_pairs=int(checks['overlaps'].sum()),
+                            displays_outside_bounding_circle=int(np.count_nonzero(checks['outside'])),
+                            circles_outside_bounding_circle=int(checks['outside'].sum()),
+                            number_of_circles_mismatches=int(count_error.sum()),
+                            equal_number_pairs=int(np.sum(ratio == 1)),
+                            density_mismatches=int(np.sum(density_error > density_tolerance)),
+                            convex_hull_proportion_mismatches=int(np.sum(hull_error > hull_tolerance)),
+                            max_convex_hull_proportion_error=float(hull_error.max()) if len(hull_error) else None),
+                distributions=dict(number_of_circles=summarize(arrays['K']),
+                                   density=summarize(arrays['density']),
+                                   convex_hull_proportion=summarize(arrays['convex_hull_proportion']),
+                                   density_in_window=in_window(arrays['density'], *density_target),
+                                   convex_hull_proportion_in_window=in_window(arrays['convex_hull_proportion'],
+                                                                              *hull_target),
+                                   numerical_ratio=summarize(ratio),
+                                   area_ratio=summarize(area_ratio),
+                                   left_larger_proportion=float(left_larger.mean()) if len(ratio) else None),
+                cues=cue_report(arrays['K'], cues, arrays['pairs']))
+
+
+def blob_report(arrays, area_tolerance=1e-9):
+
+    polygon_area, perimeter = (polygon_areas_and_perimeters(arrays['vertices'], arrays['offsets'])
+                               if len(arrays['vertices']) else (np.zeros(0), np.zeros(0)))
+
+    # blob areas are proportions of the unit bounding circle
+    area_error = np.abs(np.abs(polygon_area) / np.pi - arrays['area'])
+
+    outside = np.sqrt(np.square(arrays['vertices']).sum(axis=1)) > 1.0
+    starts = arrays['offsets'][:-1]
+    displays_outside = np.add.reduceat(outside, starts) if len(outside) else np.zeros(0)
+
+    ratio, left_larger = pair_ratios(arrays['area'], arrays['pairs'])
+    perimeter_ratio, _ = pair_ratios(perimeter, arrays['pairs'])
+
+    return dict(displays=int(len(arrays['uid'])),
+                pairs=int(len(arrays['pairs'])),
+                repeated_pairs=repeated_pairs(arrays['uid'], arrays['pairs']),
+                checks=dict(displays_outside_bounding_circle=int(np.count_nonzero(displays_outside)),
+                            equal_area_pairs=int(np.sum(ratio == 1)),
+                            area_mismatches=int(np.sum(area_error > area_tolerance))),
+                distributions=dict(area=summarize(arrays['area']),
+                                   perimeter=summarize(perimeter),
+                                   area_ratio=summarize(ratio),
+                                   perimeter_ratio=summarize(perimeter_ratio),
+                                   left_larger_proportion=float(left_larger.mean()) if len(ratio) else None))
+
+
+def qa_report(blocks_stimuli, processes=None):
+    "Quality assurance report of the dots and blobs of an ANS task stimuli list"
+
+    return dict(blocks=len(blocks_stimuli),
+                dots=dot_report(dot_arrays(blocks_stimuli), processes=processes),
+                blobs=blob_report(blob_arrays(blocks_stimuli)))
+
+
+def print_report(report):
+
+    dots, blobs = report['dots'], report['blobs']
+
+    print('Blocks: %d' % report['blocks'])
+
+    print('Dots: %d displays, %d pairs (%d repeated)' % (dots['displays'], dots['pairs'], dots['repeated_pairs']))
+    for name, value in dots['checks'].items():
+        print('  %s: %s' % (name, value))
+    for name in ('number_of_circles', 'density', 'convex_hull_proportion', 'numerical_ratio', 'area_ratio'):
+        summary = dots['distributions'][name]
+        if summary['n']:
+            print('  %s: mean %.4g, range [%.4g, %.4g]' % (name, summary['mean'],
+                                                           summary['quantiles']['min'],
+                                                           summary['quantiles']['max']))
+    for name, cue in dots['cues'].items():
+        print('  %s: r(display) %s, r(pair) %s' % (name, cue['display_correlation'], cue['pair_correlation']))
+
+    print('Blobs: %d displays, %d pairs (%d repeated)' % (blobs['displays'], blobs['pairs'], blobs['repeated_pairs']))
+    for name, value in blobs['checks'].items():
+        print('  %s: %s' % (name, value))
+    for name in ('area', 'area_ratio'):
+        summary = blobs['distributions'][name]
+        if summary['n']:
+            print('  %s: mean %.4g, range [%.4g, %.4g]' % (name, summary['mean'],
+                                                           summary['quantiles']['min'],
+                                                           summary['quantiles']['max']))
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(prog='qa_ans_stimuli',
+                                     description='Check and summarize a json file of ANS task stimuli.')
+
+    parser.add_argument('filename', help='The json stimuli filename.')
+    parser.add_argument('-o', '--output', default=None, required=False,
+                        help='The json report filename (default: <filename>_qa.json).')
+    parser.add_argument('-p', '--processes', default=os.cpu_count(), type=int, required=False,
+                        help='The number of worker processes (default: number of cores).')
+
+    args = parser.parse_args()
+
+    report = qa_report(load_stimuli(args.filename), processes=args.processes)
+    report['filename'] = args.filename
+
+    print_report(report)
+
+    output = args.output or os.path.splitext(args.filename)[0] + '_qa.json'
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
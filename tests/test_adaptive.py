@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from ans_adaptive import AdaptiveSelector, BayesianRatioEstimator, PairIndex, Staircase, is_correct, simulate
+from ans_stimuli_file import read_stimuli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def blocks_stimuli():
+    # the four blocks of this seeded file are identical
+    return read_stimuli(os.path.join(ROOT, 'stimuli_4_5_1010101.json'))
+
+
+def test_pair_index_takes_closest_unused_pair():
+
+    index = PairIndex([1.5, 1.1, 1.3, 1.3], ['a', 'b', 'c', 'd'])
+
+    assert len(index) == 4
+    assert index.take(1.28) == ('c', 1.3)
+    assert index.take(1.28) == ('d', 1.3)
+    assert index.take(1.28) == ('b', 1.1)
+    assert index.take(1.28) == ('a', 1.5)
+    assert index.take(1.28) is None
+    assert len(index) == 0
+
+
+def test_from_stimuli_indexes_the_display_pool(blocks_stimuli):
+
+    index = PairIndex.from_stimuli(blocks_stimuli, 'dots')
+    displays = blocks_stimuli[0]['dots']['displays']
+
+    # all pairs of the 10 distinct displays but the 3 pairs of the 3 displays of 47 circles
+    assert len(index) == 45 - 3
+    assert len({frozenset(pair[:2]) for pair in index.pairs}) == 42
+    # the pairs of the file are part of the pool
+    assert {frozenset(pair) for pair in blocks_stimuli[0]['dots']['stimuli']} < \
+        {frozenset(pair[:2]) for pair in index.pairs}
+
+    for (left_uid, right_uid, pool), ratio in zip(index.pairs, index.ratios):
+        left, right = pool[left_uid]['number_of_circles'], pool[right_uid]['number_of_circles']
+        assert left != right
+        assert ratio == max(left, right) / min(left, right)
+        assert pool[left_uid] is displays[left_uid]
+
+    assert len(PairIndex.from_stimuli(blocks_stimuli[:1], 'blobs')) == 45
+
+
+def test_from_stimuli_pools_displays_of_all_blocks(blocks_stimuli):
+
+    first, second = blocks_stimuli[0]['dots'], dict(blocks_stimuli[1]['dots'])
+    second['stimuli'] = [[uid + 'x' for uid in pair] for pair in first['stimuli']]
+    second['displays'] = {uid + 'x': display for uid, display in first['displays'].items()}
+
+    index = PairIndex.from_stimuli([dict(dots=first), dict(dots=second)], 'dots')
+
+    # a display of the first block can be paired with one of the second
+    assert any(left.endswith('x') != right.endswith('x') for left, right, _ in index.pairs)
+
+
+def test_pairs_are_used_once_across_blocks(blocks_stimuli):
+
+    selector = AdaptiveSelector.from_stimuli(blocks_stimuli, 'dots', 'staircase', n_trials=20)
+
+    for block in range(4):
+        simulate(selector, n_trials=5, seed=block)
+
+    assert len(selector.history) == 20
+    assert len(selector.index) == 42 - 20
+
+
+def test_small_pools_warn(blocks_stimuli):
+
+    with pytest.warns(UserWarning, match='50 blobs trials requested from a pool of 45 pairs'):
+        selector = AdaptiveSelector.from_stimuli(blocks_stimuli, 'blobs', 'staircase', n_trials=50)
+
+    with pytest.warns(UserWarning):
+        simulate(selector, n_trials=50, kind='blobs')
+
+    assert len(selector.history) == 45
+
+
+@pytest.mark.parametrize('method', [Staircase, BayesianRatioEstimator])
+def test_simulate_is_reproducible(blocks_stimuli, method):
+
+    def session(seed):
+        selector = AdaptiveSelector.from_stimuli(blocks_stimuli, 'dots')
+        selector.estimator = method()
+        return simulate(selector, weber_fraction=0.3, n_trials=5, seed=seed)
+
+    history = session(7)
+
+    assert len(history) == 5
+    assert session(7) == history
+
+
+def test_is_correct():
+
+    assert is_correct('left', 12, 10) is True
+    assert is_correct('right', 12, 10) is False
+    assert is_correct(None, 12, 10) is None
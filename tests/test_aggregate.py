@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregate_ans_results import aggregate
+from ans_stimuli_file import read_stimuli, write_stimuli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STIMULI = 'stimuli_4_5_1010101'
+
+
+def trial(left_uid, right_uid, key_pressed, correct, ratio=None):
+
+    result = dict(left_uid=left_uid, right_uid=right_uid, left_size=1, right_size=2, key_pressed=key_pressed,
+                  rt_time=0.5, rt_clock=0.5, rt_event=0.4 if key_pressed else None)
+
+    if ratio is not None:
+        result.update(target_ratio=ratio + 0.01, ratio=ratio, correct=correct)
+
+    return result
+
+
+@pytest.fixture
+def results_file(tmp_path):
+    "An adaptive session whose block 2 shows a pair of block 1"
+
+    blocks_stimuli = read_stimuli(os.path.join(ROOT, STIMULI + '.json'))
+    dots = blocks_stimuli[0]['dots']['stimuli']
+
+    # block 2 of the file does not have the first pair
+    block = blocks_stimuli[1]['dots']
+    block['stimuli'] = block['stimuli'][1:]
+    for uid in dots[0]:
+        del block['displays'][uid]
+
+    write_stimuli(blocks_stimuli, str(tmp_path / (STIMULI + '.json')))
+
+    information = dict(code='pass', participant_id='p1', participant_gender='Female', participant_age=30,
+                       participant_handedness='Right', fullscreen=True, stimuli_file=STIMULI, trial_timeout=10,
+                       break_duration=100, datetime='10_19_2026_10_00_00', response_device='keyboard',
+                       trial_selection='bayesian')
+
+    sections = [dict(block=1, type='dots', results=[trial(*dots[0], 'left', True, 1.2),
+                                                    trial(*dots[1], None, None, 1.5)]),
+                dict(block=2, type='dots', results=[trial(*dots[0], 'right', False, 1.2)])]
+
+    filename = tmp_path / 'p1_10_19_2026_10_00_00_results.json'
+    with open(filename, 'w') as f:
+        json.dump([information] + sections, f)
+
+    return tmp_path, str(filename)
+
+
+@pytest.mark.parametrize('format', ['parquet', 'hdf5'])
+def test_adaptive_columns_and_metrics(results_file, format):
+
+    directory, filename = results_file
+    output = str(directory / ('out.h5' if format == 'hdf5' else 'out'))
+
+    assert aggregate([filename], output, stimuli_dir=str(directory)) == 1
+    assert aggregate([filename], output, stimuli_dir=str(directory)) == 0
+
+    if format == 'hdf5':
+        trials, sessions = pd.read_hdf(output, 'trials'), pd.read_hdf(output, 'sessions')
+    else:
+        trials, sessions = pd.read_parquet(directory / 'out' / 'trials'), pd.read_parquet(directory / 'out' / 'sessions')
+        assert trials['correct'].dtype == 'boolean'
+
+    assert list(sessions['trial_selection']) == ['bayesian']
+    assert list(trials['trial_selection']) == ['bayesian'] * 3
+
+    assert trials['ratio'].tolist() == [1.2, 1.5, 1.2]
+    assert trials['target_ratio'].dtype == np.float64
+    np.testing.assert_array_equal(trials['correct'].astype(np.float64), [1.0, np.nan, 0.0])
+
+    # the pair of block 1 shown in block 2 still has its metrics
+    assert not trials[['left_number_of_circles', 'right_density', 'left_convex_hull_proportion']].isna().any().any()
+    assert len(trials) == 3
+
+
+def test_fixed_sessions_have_empty_adaptive_columns(results_file):
+
+    directory, filename = results_file
+
+    with open(filename) as f:
+        information, *sections = json.load(f)
+
+    del information['trial_selection']
+    for section in sections:
+        for result in section['results']:
+            for column in ('target_ratio', 'ratio', 'correct'):
+                result.pop(column)
+
+    with open(filename, 'w') as f:
+        json.dump([information] + sections, f)
+
+    aggregate([filename], str(directory / 'out'), stimuli_dir=str(directory))
+    trials = pd.read_parquet(directory / 'out' / 'trials')
+
+    assert set(trials['trial_selection']) == {'fixed'}
+    assert trials['ratio'].isna().all() and trials['correct'].isna().all()
+
+
+def test_parquet_without_pyarrow(results_file, monkeypatch):
+
+    directory, filename = results_file
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+
+    with pytest.raises(ImportError, match='Parquet output needs pyarrow'):
+        aggregate([filename], str(directory / 'out'), stimuli_dir=str(directory))
+
+    assert not (directory / 'out').exists()
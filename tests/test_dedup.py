@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import pytest
+
+from ans_dedup import BLOB_MAX_DISTANCE, MAX_DISTANCE, DuplicateIndex, find_duplicates, stimuli_duplicates
+from ans_stimuli_file import read_stimuli
+from generate_ans_stimuli import RandomDotDisplay, maxint
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STIMULI = 'stimuli_4_5_1010101.json'
+
+RADIUS_RANGE = [0.05, 0.1]
+
+
+@pytest.fixture(scope='module')
+def pool():
+
+    _random = np.random.RandomState(5)
+
+    K = _random.randint(40, 60, size=200)
+    seeds = _random.randint(maxint, size=200)
+
+    return [RandomDotDisplay(K=int(k), seed=int(seed), radius_range=RADIUS_RANGE) for k, seed in zip(K, seeds)]
+
+
+def indexed(displays):
+
+    index = DuplicateIndex()
+    for display in displays:
+        index.add(display.uid, (display.seed, display.K), index.fingerprint(display.circles))
+
+    return index
+
+
+def test_unrelated_displays_are_not_near_duplicates(pool):
+
+    index = DuplicateIndex()
+    fingerprints = np.array([index.fingerprint(display.circles) for display in pool])
+
+    duplicates = find_duplicates([display.uid for display in pool], [(display.seed, display.K) for display in pool],
+                                 fingerprints, index)
+
+    assert duplicates == dict(uid_collisions=[], near_duplicates=[])
+
+    # the closest unrelated displays are well beyond the threshold
+    distances = (fingerprints[:, None] != fingerprints[None]).mean(axis=2)
+    assert distances[np.triu_indices(len(pool), k=1)].min() > 1.5 * MAX_DISTANCE
+
+
+def test_jittered_copies_are_found(pool):
+
+    index = indexed(pool)
+    _random = np.random.RandomState(6)
+
+    for display in pool:
+
+        circles = display.circles.copy()
+        circles[:, :2] += _random.normal(0, 0.01, size=(display.K, 2))
+
+        duplicates = dict(index.near_duplicates('jittered', None, index.fingerprint(circles)))
+
+        assert list(duplicates) == [display.uid]
+        assert 0 < duplicates[display.uid] <= MAX_DISTANCE
+
+
+def test_shifted_blobs_are_found():
+
+    blobs = read_stimuli(os.path.join(ROOT, STIMULI))[0]['blobs']['displays']
+
+    index = DuplicateIndex(max_distance=BLOB_MAX_DISTANCE)
+    for uid, display in blobs.items():
+        index.add(uid, None, index.polygon_fingerprint(display['vertices']))
+
+    for uid, display in blobs.items():
+
+        shifted = np.asarray(display['vertices']) + 0.005
+        duplicates = dict(index.near_duplicates('shifted', None, index.polygon_fingerprint(shifted)))
+
+        assert list(duplicates) == [uid]
+
+
+def test_uid_collisions(pool):
+
+    index = indexed(pool[:1])
+    display = pool[0]
+
+    assert not index.uid_collision(display.uid, (display.seed, display.K))
+    assert index.uid_collision(display.uid, (display.seed + 1, display.K))
+    assert index.uid_collision(display.uid, (display.seed, display.K + 1))
+    assert not index.uid_collision('0000000', (display.seed + 1, display.K))
+
+    other = pool[1]
+    fingerprints = np.array([index.fingerprint(display.circles), index.fingerprint(other.circles)])
+    duplicates = find_duplicates([display.uid, display.uid], [(display.seed, display.K), (other.seed, other.K)],
+                                 fingerprints)
+
+    assert duplicates['uid_collisions'] == [(display.uid, (other.seed, other.K), (display.seed, display.K))]
+    assert duplicates['near_duplicates'] == []
+
+
+def test_displays_repeated_across_blocks_are_not_reported():
+
+    blocks_stimuli = read_stimuli(os.path.join(ROOT, STIMULI))
+    assert blocks_stimuli[0] == blocks_stimuli[-1]
+
+    report = stimuli_duplicates(blocks_stimuli)
+
+    for kind in ('dots', 'blobs'):
+        assert report[kind] == dict(uid_collisions=[], near_duplicates=[])
+
+
+def test_displays_added_again_are_not_indexed_twice(pool):
+
+    index = indexed(pool[:3] + pool[:3])
+
+    assert len(index) == 3
+    assert index.keys(pool[0].uid) == [(pool[0].seed, pool[0].K)]
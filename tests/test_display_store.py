@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+
+from ans_display_store import DisplayStore
+from ans_stimuli_file import read_stimuli
+from generate_ans_stimuli import make_dot_display_stimuli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_from_displays_round_trip():
+
+    displays = read_stimuli(os.path.join(ROOT, 'stimuli_4_5_1010101.json'))[0]['dots']['displays']
+    store = DisplayStore.from_displays(displays)
+
+    assert len(store) == len(displays)
+    assert store.to_displays() == displays
+    assert store.circles.flags['C_CONTIGUOUS'] and store.circles.shape == (store.K.sum(), 3)
+
+
+def test_from_displays_can_grow():
+
+    store = DisplayStore.from_displays({})
+    assert len(store) == 0
+
+    row = store.append('abcdefg', 1, np.ones((4, 3)), 0.1, 0.5)
+
+    assert row == 0
+    assert store['abcdefg']['number_of_circles'] == 4
+
+
+def test_generated_store_matches_displays():
+
+    store = make_dot_display_stimuli(3, seed=5, as_store=True)['displays']
+    displays = make_dot_display_stimuli(3, seed=5)['displays']
+
+    assert store.to_displays() == displays
+    assert all(isinstance(display['circles'], list) for display in displays.values())
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import ans_dot_batch
+from ans_dot_batch import make_dot_display_batch
+from generate_ans_stimuli import RandomDotDisplay, maxint
+
+RADIUS_RANGE = [0.05, 0.15]
+
+
+@pytest.fixture(scope='module')
+def pool():
+
+    _random = np.random.RandomState(3)
+
+    K = _random.randint(5, 60, size=24)
+    seeds = [int(seed) for seed in _random.randint(maxint, size=24)]
+
+    # display 1 takes more than one round of 624 attempt seeds
+    K[1], seeds[1] = 70, 1
+    displays = [RandomDotDisplay(K=int(k), seed=seed, radius_range=RADIUS_RANGE) for k, seed in zip(K, seeds)]
+
+    return K, seeds, displays
+
+
+def assert_same_displays(batch, displays):
+
+    for i, display in enumerate(displays):
+        assert np.array_equal(batch.circles[i, :display.K], display.circles)
+        assert batch.uids[i] == display.uid
+        assert batch.density[i] == display.density
+
+
+def test_chunks_give_the_displays_of_random_dot_display(pool, monkeypatch):
+
+    K, seeds, displays = pool
+    monkeypatch.setattr(ans_dot_batch, 'CHUNK_DISPLAYS', 5)
+
+    batch = make_dot_display_batch(K, seeds, RADIUS_RANGE)
+
+    assert_same_displays(batch, displays)
+    assert np.array_equal(batch.convex_hull_proportion, [display.convex_hull_area for display in displays])
+
+
+def test_support_hull_is_a_close_lower_bound(pool):
+
+    K, seeds, displays = pool
+
+    exact = make_dot_display_batch(K, seeds, RADIUS_RANGE).convex_hull_proportion
+    support = make_dot_display_batch(K, seeds, RADIUS_RANGE, hull='support').convex_hull_proportion
+
+    assert np.all(support <= exact + 1e-12)
+    assert np.all(exact - support < 5e-4)
+
+
+def test_qhull_over_processes(pool):
+
+    K, seeds, displays = pool
+
+    batch = make_dot_display_batch(K, seeds, RADIUS_RANGE, processes=2)
+
+    assert np.array_equal(batch.convex_hull_proportion, [display.convex_hull_area for display in displays])
+
+
+def test_unknown_hull_method(pool):
+
+    K, seeds, displays = pool
+
+    with pytest.raises(ValueError):
+        make_dot_display_batch(K[:1], seeds[:1], RADIUS_RANGE, hull='exact')
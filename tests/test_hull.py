@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from ans_hull import SupportHull, hull_areas
+from generate_ans_stimuli import RandomDotDisplay
+
+
+@pytest.fixture(scope='module')
+def displays():
+    return [RandomDotDisplay(K=K, seed=seed) for K, seed in ((5, 1), (12, 2), (30, 3))]
+
+
+def padded(displays):
+
+    Kmax = max(display.K for display in displays)
+    circles = np.zeros((len(displays), Kmax, 3))
+    mask = np.zeros((len(displays), Kmax), dtype=bool)
+
+    for i, display in enumerate(displays):
+        circles[i, :display.K] = display.circles
+        mask[i, :display.K] = True
+
+    return circles, mask
+
+
+def test_support_hull_matches_batched_areas(displays):
+
+    areas = hull_areas(*padded(displays), directions=360)
+
+    for display, area in zip(displays, areas):
+
+        hull = SupportHull(360)
+        for circle in display.circles:
+            hull.add(circle)
+
+        assert hull.area == pytest.approx(area, rel=1e-12)
+
+
+@pytest.mark.parametrize('directions', [360, 720])
+def test_areas_bound_the_qhull_area_from_below(displays, directions):
+
+    areas = hull_areas(*padded(displays), directions=directions)
+    qhull = np.array([display.convex_hull.volume for display in displays])
+
+    assert np.all(areas <= qhull + 1e-12)
+    assert np.allclose(areas, qhull, rtol=1e-3)
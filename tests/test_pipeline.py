@@ -0,0 +1,140 @@
+import filecmp
+import os
+import subprocess
+import sys
+
+from ans_stimuli_file import read_stimuli
+from generate_ans_stimuli import PairPipeline, RandomDotDisplay, make_dot_display_stimuli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR = os.path.join(ROOT, 'generate_ans_stimuli.py')
+STIMULI = 'stimuli_4_5_1010101.json'
+
+RADIUS_RANGE = (0.05, 0.1)
+
+DENSITY_WINDOW = (0.26, 0.03)
+HULL_WINDOW = (0.84, 0.02)
+
+
+def generate(tmp_path, *args):
+    "Run the generator CLI with `args`, returning the name of the file it writes"
+
+    filename = str(tmp_path / 'stimuli.json')
+    subprocess.run([sys.executable, GENERATOR, '-f', filename] + [str(arg) for arg in args], check=True, cwd=ROOT)
+
+    return filename
+
+
+def test_equal_numbers_are_rejected_before_placement():
+
+    pipeline = PairPipeline()
+
+    assert pipeline((45, 45), (1, 2), RADIUS_RANGE, {}) is None
+
+    assert (pipeline.stats['number']['calls'], pipeline.stats['number']['rejected']) == (1, 1)
+    for stage in ('density_bounds', 'placement', 'hull'):
+        assert pipeline.stats[stage]['calls'] == 0
+
+
+def test_unreachable_density_window_is_rejected_before_placement():
+
+    # 59 circles of the largest radius cover at most 0.59 of the bounding circle
+    pipeline = PairPipeline(density_window=(0.9, 0.01), hull_window=HULL_WINDOW)
+
+    assert pipeline((40, 59), (1, 2), RADIUS_RANGE, {}) is None
+
+    assert pipeline.stats['density_bounds']['rejected'] == 1
+    for stage in ('duplicate', 'placement', 'hull'):
+        assert pipeline.stats[stage]['calls'] == 0
+
+
+def test_known_pairs_are_rejected_before_placement():
+
+    pipeline = PairPipeline()
+    left, right = pipeline((40, 50), (1, 2), RADIUS_RANGE, {})
+
+    assert pipeline((40, 50), (1, 2), RADIUS_RANGE, {(left.uid, right.uid): None}) is None
+
+    assert pipeline.stats['duplicate']['rejected'] == 1
+    assert pipeline.stats['placement']['calls'] == 1
+
+
+def test_accepted_pairs_pass_every_stage():
+
+    pipeline = PairPipeline()
+    stimuli = make_dot_display_stimuli(N=5, seed=3, pipeline=pipeline)
+
+    assert len(stimuli['stimuli']) == 5
+    for stage, stats in pipeline.stats.items():
+        assert stats['calls'] - stats['rejected'] == 5, stage
+
+    assert pipeline.report().splitlines()[0].split() == ['stage', 'calls', 'rejected', 'seconds', 'ms/call']
+
+
+def test_default_pipeline_reproduces_the_stimuli_file(tmp_path):
+
+    filename = generate(tmp_path, '-b', 4, '-n', 5, '-s', 1010101)
+
+    assert filecmp.cmp(filename, os.path.join(ROOT, STIMULI), shallow=False)
+
+
+def test_windows_apply_to_both_displays(tmp_path):
+
+    windowed = read_stimuli(generate(tmp_path, '-b', 1, '-n', 5, '-s', 5, '--density-window', *DENSITY_WINDOW,
+                                     '--hull-window', *HULL_WINDOW))[0]['dots']
+    unfiltered = read_stimuli(generate(tmp_path, '-b', 1, '-n', 5, '-s', 5))[0]['dots']
+
+    def in_windows(display):
+        return (abs(display['density'] - DENSITY_WINDOW[0]) < DENSITY_WINDOW[1] and
+                abs(display['convex_hull_proportion'] - HULL_WINDOW[0]) < HULL_WINDOW[1])
+
+    assert len(windowed['stimuli']) == 5
+    for left, right in windowed['stimuli']:
+        assert in_windows(windowed['displays'][left])
+        assert in_windows(windowed['displays'][right])
+
+    # the same seed gives displays out of the windows without them
+    assert not all(in_windows(display) for display in unfiltered['displays'].values())
+
+
+def test_early_abort_gives_the_same_pairs():
+
+    windows = dict(density_window=(0.26, 0.01), hull_window=(0.84, 0.005))
+    aborting, placing = PairPipeline(**windows), PairPipeline(early_abort=False, **windows)
+
+    aborted = make_dot_display_stimuli(N=1, seed=7, pipeline=aborting)
+    placed = make_dot_display_stimuli(N=1, seed=7, pipeline=placing)
+
+    assert aborted == placed
+
+    # the same candidates were rejected, during placement rather than after it
+    assert aborting.stats['placement']['calls'] == placing.stats['placement']['calls']
+    assert aborting.stats['placement']['rejected'] > 0 == placing.stats['placement']['rejected']
+    assert placing.stats['density']['rejected'] > aborting.stats['density']['rejected'] == 0
+
+
+def display(K=50, seed=11):
+    return RandomDotDisplay(K=K, radius_range=RADIUS_RANGE, seed=seed, generate=False)
+
+
+def test_density_bounds_are_inclusive_within_the_margin():
+
+    # 10 circles cover between 0.025 and 0.1 of the bounding circle
+    for window, reachable in [((0.02, 0.005), True), ((0.02, 0.005 - 1e-6), False),
+                              ((0.105, 0.005), True), ((0.105, 0.005 - 1e-6), False)]:
+        assert display()._density_reachable(0.0, 10, window) == reachable, window
+
+
+def test_placement_aborts_only_outside_the_windows():
+
+    full = display()
+    assert full.generate()
+
+    # windows whose upper edges are the final metrics are never ruled out by the circles placed so far
+    assert display().generate(density_window=(full.density - 0.01, 0.01))
+    assert display().generate(hull_window=(full.convex_hull_area - 0.01, 0.01))
+
+    aborted = display()
+    assert not aborted.generate(density_window=(full.density - 0.03, 0.01))
+    assert aborted.circles is None
+    assert not display().generate(hull_window=(full.convex_hull_area - 0.03, 0.01))
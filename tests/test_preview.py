@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from preview_ans_stimuli import preview
+from qa_ans_stimuli import load_stimuli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def blocks_stimuli():
+    return load_stimuli(os.path.join(ROOT, 'stimuli_4_5_1010101.json'))
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_preview_pages(blocks_stimuli, tmp_path, processes):
+
+    # 20 pairs of each kind, 8 per page
+    filenames = preview(blocks_stimuli, str(tmp_path), name='stimuli', per_page=8, processes=processes)
+
+    expected = ['stimuli_%s_%03d.png' % (kind, page) for kind in ('dots', 'blobs') for page in (1, 2, 3)]
+
+    assert [os.path.basename(filename) for filename in filenames] == expected
+    assert sorted(os.listdir(tmp_path)) == sorted(expected)
+
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+
+def test_preview_one_kind(blocks_stimuli, tmp_path):
+
+    filenames = preview(blocks_stimuli[:1], str(tmp_path), name='first', kinds=('blobs',), processes=1)
+
+    assert [os.path.basename(filename) for filename in filenames] == ['first_blobs_001.png']
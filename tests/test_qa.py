@@ -0,0 +1,57 @@
+import copy
+import os
+
+import pytest
+
+from qa_ans_stimuli import load_stimuli, qa_report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def blocks_stimuli():
+    return load_stimuli(os.path.join(ROOT, 'stimuli_4_5_1010101.json'))
+
+
+def test_correct_file_passes_every_check(blocks_stimuli):
+
+    report = qa_report(blocks_stimuli, processes=1)
+
+    dots, blobs = report['dots']['checks'], report['blobs']['checks']
+
+    assert report['blocks'] == 4
+    for name, count in dots.items():
+        if name != 'max_convex_hull_proportion_error':
+            assert count == 0, name
+    assert dots['max_convex_hull_proportion_error'] < 1e-3
+    assert blobs == dict(displays_outside_bounding_circle=0, equal_area_pairs=0, area_mismatches=0)
+
+
+def test_injected_overlap_and_out_of_bounds_circles_are_counted(blocks_stimuli):
+
+    block_stimuli = copy.deepcopy(blocks_stimuli[0])
+    (left_uid, right_uid) = block_stimuli['dots']['stimuli'][0]
+    displays = block_stimuli['dots']['displays']
+
+    # a circle moved onto another one of its display, and one moved across the bounding circle
+    x, y, radius = displays[left_uid]['circles'][0]
+    displays[left_uid]['circles'][1] = [x + radius / 2, y, radius]
+    displays[right_uid]['circles'][0] = [0.99, 0.0, 0.05]
+
+    checks = qa_report([block_stimuli], processes=1)['dots']['checks']
+
+    assert checks['overlapping_displays'] == 1
+    assert checks['overlapping_circle_pairs'] >= 1
+    assert checks['displays_outside_bounding_circle'] == 1
+    assert checks['circles_outside_bounding_circle'] == 1
+    # the stored density no longer matches the circles
+    assert checks['density_mismatches'] == 2
+
+
+def test_repeated_blocks_are_counted(blocks_stimuli):
+
+    report = qa_report(blocks_stimuli, processes=1)
+
+    # the 4 blocks of this seeded file list the same 5 pairs
+    assert report['dots']['pairs'] == 20
+    assert report['dots']['repeated_pairs'] == 15
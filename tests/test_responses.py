@@ -0,0 +1,95 @@
+import sys
+import types
+
+import pytest
+
+from ans_responses import EventResponses, make_response_device
+
+
+@pytest.fixture
+def fake_event(monkeypatch):
+    "A psychopy.event with a key buffer, and a psychopy.core clock at 0"
+
+    event = types.ModuleType('psychopy.event')
+    event.buffer = []
+    event.clearEvents = event.buffer.clear
+
+    def getKeys(keyList=None, timeStamped=False):
+        keys = [key for key in event.buffer if keyList is None or key in keyList]
+        event.buffer[:] = [key for key in event.buffer if key not in keys]
+        return [(key, 0.0) for key in keys] if timeStamped else keys
+
+    event.getKeys = getKeys
+
+    core = types.ModuleType('psychopy.core')
+    core.Clock = lambda: types.SimpleNamespace(reset=lambda: None, getTime=lambda: 0.0)
+
+    psychopy = types.ModuleType('psychopy')
+    psychopy.event, psychopy.core = event, core
+
+    monkeypatch.setitem(sys.modules, 'psychopy', psychopy)
+    monkeypatch.setitem(sys.modules, 'psychopy.event', event)
+    monkeypatch.setitem(sys.modules, 'psychopy.core', core)
+
+    return event
+
+
+def test_event_responses_drop_keys_not_listed(fake_event):
+
+    responses = EventResponses()
+    responses.start()
+
+    fake_event.buffer.extend(['space', 'left', 'a'])
+
+    assert responses.get_keys(['left', 'right', 'escape']) == [('left', 0.0)]
+    # the other keys must not remain to end the next screen
+    assert fake_event.getKeys() == []
+
+
+def test_scripted_device():
+
+    now = [0.0]
+    responses = make_response_device('scripted', responses=[('left', 0.5), None, ('escape', 0.1)],
+                                     clock=lambda: now[0])
+
+    responses.start()
+    assert responses.get_keys(['left', 'right']) == []
+    now[0] = 0.6
+    assert responses.get_keys(['left', 'right']) == [('left', 0.5)]
+    assert responses.get_keys(['left', 'right']) == []
+
+    responses.start()
+    now[0] = 10.0
+    assert responses.get_keys() == []
+
+    responses.start()
+    now[0] = 10.2
+    assert responses.get_keys(['left', 'right']) == []
+    assert responses.get_keys(['escape']) == []
+
+
+def test_unknown_device():
+
+    with pytest.raises(ValueError):
+        make_response_device('mouse')
+
+
+def test_keyboard_falls_back_to_event_with_a_warning(fake_event, monkeypatch):
+
+    # importing psychopy.hardware fails
+    monkeypatch.setitem(sys.modules, 'psychopy.hardware', None)
+
+    with pytest.warns(UserWarning, match='falling back to psychopy.event'):
+        responses = make_response_device('keyboard')
+
+    assert responses.name == 'event'
+
+
+def test_keyboard_errors_are_not_hidden(fake_event, monkeypatch):
+
+    hardware = types.ModuleType('psychopy.hardware')
+    hardware.keyboard = types.SimpleNamespace(Keyboard=lambda: 1 / 0)
+    monkeypatch.setitem(sys.modules, 'psychopy.hardware', hardware)
+
+    with pytest.raises(ZeroDivisionError):
+        make_response_device('keyboard')
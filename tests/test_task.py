@@ -0,0 +1,295 @@
+"""
+Headless runs of ans_task.py against a stand-in for PsychoPy, on a virtual
+clock that advances one 60 Hz frame per flip.
+"""
+
+import glob
+import inspect
+import json
+import os
+import runpy
+import shutil
+import sys
+import time
+import types
+
+import pytest
+
+import ans_responses
+from ans_responses import ScriptedResponses
+from ans_stimuli_file import read_stimuli, write_stimuli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TASK = os.path.join(ROOT, 'ans_task.py')
+STIMULI = 'stimuli_4_5_1010101.json'
+
+FRAME = 1.0 / 60
+
+DEFAULT_CHOICES = {'Participant ID': 'test', 'Fullscreen': False, 'Parallel port': False,
+                   'Break duration': 5, 'Trial timeout': 1, 'ISI': 1.0}
+
+
+class VirtualTime(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fake_psychopy(now, choices):
+    "The psychopy modules used by the task, on the virtual time `now`, with the dialog answered from `choices`"
+
+    core = types.ModuleType('psychopy.core')
+
+    class Clock(object):
+
+        def __init__(self):
+            self.start = now()
+
+        def reset(self):
+            self.start = now()
+
+        def getTime(self):
+            return now() - self.start
+
+    def quit():
+        raise SystemExit
+
+    core.Clock = Clock
+    core.monotonicClock = Clock()
+    core.getTime = now
+    core.quit = quit
+
+    gui = types.ModuleType('psychopy.gui')
+
+    class DlgFromDict(object):
+
+        def __init__(self, dictionary, **kwargs):
+
+            for key, value in dictionary.items():
+                if key in choices:
+                    dictionary[key] = choices[key]
+                elif isinstance(value, list):
+                    dictionary[key] = value[0]
+
+            self.OK = True
+
+    gui.DlgFromDict = DlgFromDict
+    gui.messages = []
+    gui.criticalDlg = lambda title, prompt: gui.messages.append(prompt)
+
+    event = types.ModuleType('psychopy.event')
+    event.buffer = []
+    event.returned = []
+    event.polls = 0
+
+    def clearEvents():
+        event.buffer.clear()
+        event.polls = 0
+
+    def getKeys(keyList=None, timeStamped=False):
+        # a participant pressing space on the third poll of a screen
+        event.polls += 1
+        if not event.buffer and event.polls >= 3:
+            event.buffer.append('space')
+
+        keys, event.buffer[:] = list(event.buffer), []
+        event.returned.extend(keys)
+
+        return keys
+
+    event.clearEvents = clearEvents
+    event.getKeys = getKeys
+
+    visual = types.ModuleType('psychopy.visual')
+
+    class Window(object):
+
+        def __init__(self, size, **kwargs):
+            self.size = size
+            self.callbacks = []
+            self.flips = 0
+
+        def callOnFlip(self, function, *args):
+            self.callbacks.append((function, args))
+
+        def flip(self):
+
+            # as PsychoPy, the timestamp is read before the callbacks run
+            now.now += FRAME
+            self.flips += 1
+            flip_time = core.monotonicClock.getTime()
+
+            callbacks, self.callbacks = self.callbacks, []
+            for function, args in callbacks:
+                function(*args)
+
+            return flip_time
+
+    class Stim(object):
+
+        def __init__(self, *args, **kwargs):
+            self.text = kwargs.get('text')
+
+        def setText(self, text):
+            self.text = text
+
+        def draw(self):
+            pass
+
+    visual.Window = Window
+    visual.TextStim = visual.Circle = visual.ShapeStim = Stim
+
+    psychopy = types.ModuleType('psychopy')
+    psychopy.core, psychopy.gui, psychopy.event, psychopy.visual = core, gui, event, visual
+
+    return dict(psychopy=psychopy, core=core, gui=gui, event=event, visual=visual)
+
+
+class KeyPressResponses(ScriptedResponses):
+
+    "Scripted responses whose key presses also reach psychopy.event, as real ones do"
+
+    def __init__(self, event, responses, clock):
+        super().__init__(responses, clock)
+        self.event = event
+
+    def get_keys(self, key_list=None):
+
+        keys = super().get_keys(key_list)
+        self.event.buffer.extend(key for key, _ in keys)
+
+        return keys
+
+
+@pytest.fixture
+def run_task(tmp_path, monkeypatch):
+    """
+    Run ans_task.py in a directory holding the `stimuli` files (names or
+    lists of blocks) with the dialog `choices`, returning the results and
+    modules; modules['quit'] is set if the task quit.
+    """
+
+    def run(choices, responses, stimuli=(STIMULI,)):
+
+        for stimuli_file in stimuli:
+            if isinstance(stimuli_file, str):
+                shutil.copy(os.path.join(ROOT, stimuli_file), tmp_path)
+            else:
+                write_stimuli(stimuli_file, str(tmp_path / 'stimuli_empty.json'))
+        monkeypatch.chdir(tmp_path)
+
+        now = VirtualTime()
+        modules = fake_psychopy(now, dict(DEFAULT_CHOICES, **choices))
+
+        monkeypatch.setitem(sys.modules, 'psychopy', modules['psychopy'])
+        for name in ('core', 'gui', 'event', 'visual'):
+            monkeypatch.setitem(sys.modules, 'psychopy.' + name, modules[name])
+
+        monkeypatch.setattr(time, 'time', now)
+        # the task saves its own code, as the outermost frame of a real run
+        monkeypatch.setattr(inspect, 'stack', lambda: [types.SimpleNamespace(filename=TASK)])
+
+        device = KeyPressResponses(modules['event'], responses, now)
+        monkeypatch.setattr(ans_responses, 'make_response_device', lambda name: device)
+
+        try:
+            runpy.run_path(TASK, run_name='__main__')
+        except SystemExit:
+            modules['quit'] = True
+
+        results = None
+        for filename in glob.glob(str(tmp_path / 'test_*_results.json')):
+            with open(filename) as f:
+                results = json.load(f)
+
+        return results, modules
+
+    return run
+
+
+def trials(results):
+    return [trial for block in results[1:] for trial in block['results']]
+
+
+def test_scripted_responses_are_recorded_with_their_rt(run_task):
+
+    responses = [('left', 0.25), ('right', 0.5), None] * 14
+    results, modules = run_task(dict(), responses)
+
+    assert len(results) == 1 + 4 * 2
+    assert [block['block'] for block in results[1:]] == [1, 1, 2, 2, 3, 3, 4, 4]
+
+    for trial, response in zip(trials(results), responses):
+        if response is None:
+            assert trial['key_pressed'] is None
+            assert trial['rt_event'] is None
+        else:
+            assert (trial['key_pressed'], trial['rt_event']) == response
+            # the response is taken on the first flip after the scripted rt
+            assert response[1] <= trial['rt_time'] < response[1] + 2 * FRAME
+
+
+def test_trial_key_presses_do_not_skip_screens(run_task):
+
+    results, modules = run_task(dict(), [('left', 0.1)] * 40)
+
+    assert len(trials(results)) == 40
+    # the screens between trials were ended by their own key presses, not by stale trial responses
+    assert set(modules['event'].returned) == {'space'}
+
+
+def test_triggers_are_logged_against_flips(run_task):
+
+    results, modules = run_task(dict(), [('right', 0.1)] * 40)
+
+    triggers = results[0]['triggers']
+    labels = [trigger['label'] for trigger in triggers]
+
+    assert labels.count('start_dot_trial') == labels.count('start_blob_trial') == 20
+    assert labels.count('right_response') == 40
+    assert all(trigger['latency'] == pytest.approx(0.0) for trigger in triggers if trigger['latency'] is not None)
+
+
+@pytest.mark.parametrize('selection', ['bayesian', 'staircase'])
+def test_adaptive_selection_runs_every_block(run_task, selection):
+
+    results, modules = run_task({'Trial selection': selection}, [('left', 0.2), ('right', 0.3)] * 20)
+
+    assert results[0]['trial_selection'] == selection
+    # the trials per block of the file, taken from a pool of 42 dots and 45 blobs pairs
+    assert [len(block['results']) for block in results[1:]] == [5] * 8
+
+    blocks_stimuli = read_stimuli(os.path.join(ROOT, STIMULI))
+
+    for kind in ('dots', 'blobs'):
+
+        shown = [frozenset((trial['left_uid'], trial['right_uid']))
+                 for block in results[1:] if block['type'] == kind for trial in block['results']]
+        listed = {frozenset(pair) for pair in blocks_stimuli[0][kind]['stimuli']}
+
+        assert len(set(shown)) == len(shown) == 20
+        assert not set(shown) <= listed
+
+    for trial in trials(results):
+        assert trial['target_ratio'] >= 1
+        assert trial['ratio'] >= 1
+        assert trial['correct'] in (True, False)
+
+
+def test_no_stimuli_files(run_task):
+
+    results, modules = run_task(dict(), [], stimuli=())
+
+    assert modules['quit'] and results is None
+    assert modules['gui'].messages[0].startswith('No stimuli files found')
+
+
+def test_stimuli_file_without_blocks(run_task):
+
+    results, modules = run_task(dict(), [], stimuli=([],))
+
+    assert modules['quit'] and results is None
+    assert modules['gui'].messages == ['The stimuli file stimuli_empty has no blocks.']
@@ -0,0 +1,129 @@
+import pytest
+
+from ans_triggers import RecordingParallelPort, TriggerScheduler
+
+CODES = dict(start_dot_trial=8, left_response=12, no_response=18)
+
+
+class Clock(object):
+
+    "A clock that only moves when advanced"
+
+    def __init__(self):
+        self.time = 100.0
+
+    def __call__(self):
+        return self.time
+
+
+class FakeWindow(object):
+
+    """
+    A window that flips every 10 ms of `clock` and, as PsychoPy's, reads
+    the flip timestamp right after the swap and then runs the callOnFlip
+    callbacks, each taking `callback_delay`.
+    """
+
+    def __init__(self, clock, callback_delay=0.001):
+
+        self.clock = clock
+        self.callback_delay = callback_delay
+        self.callbacks = []
+
+    def callOnFlip(self, function, *args):
+        self.callbacks.append((function, args))
+
+    def flip(self):
+
+        self.clock.time += 0.010
+        flip_time = self.clock()
+
+        callbacks, self.callbacks = self.callbacks, []
+        for function, args in callbacks:
+            self.clock.time += self.callback_delay
+            function(*args)
+
+        return flip_time
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_queued_trigger_is_sent_on_the_next_flip(clock):
+
+    port = RecordingParallelPort(clock=clock, echo=False)
+    scheduler = TriggerScheduler(port, CODES, clock=clock)
+    win = FakeWindow(clock)
+
+    scheduler.flip(win)
+    scheduler.queue('start_dot_trial')
+
+    assert port.data == []
+
+    flip_time = scheduler.flip(win)
+
+    assert port.data == [(8, pytest.approx(flip_time + 0.001))]
+    assert len(scheduler.log) == 1
+
+    record = scheduler.log[0]
+    assert record['label'] == 'start_dot_trial'
+    assert record['frame'] == 2
+    assert record['flip'] == flip_time
+    # sent from the callback, after the flip timestamp was read
+    assert record['latency'] == pytest.approx(0.001)
+
+
+def test_triggers_are_sent_once(clock):
+
+    port = RecordingParallelPort(clock=clock, echo=False)
+    scheduler = TriggerScheduler(port, CODES, clock=clock)
+    win = FakeWindow(clock)
+
+    scheduler.queue('start_dot_trial')
+    scheduler.queue('left_response')
+    scheduler.flip(win)
+    scheduler.flip(win)
+    scheduler.flip(win)
+
+    assert [code for code, _ in port.data] == [8, 12]
+    assert [record['frame'] for record in scheduler.log] == [1, 1]
+
+
+def test_send_is_immediate_and_has_no_latency(clock):
+
+    port = RecordingParallelPort(clock=clock, echo=False)
+    scheduler = TriggerScheduler(port, CODES, clock=clock)
+
+    scheduler.send('no_response')
+
+    assert port.data == [(18, clock())]
+    assert scheduler.log[0]['latency'] is None
+    assert len(scheduler.latencies()) == 0
+
+
+def test_summary(clock):
+
+    port = RecordingParallelPort(clock=clock, echo=False)
+    scheduler = TriggerScheduler(port, CODES, clock=clock)
+
+    for delay in (0.001, 0.003):
+        win = FakeWindow(clock, callback_delay=delay)
+        scheduler.queue('start_dot_trial')
+        scheduler.flip(win)
+
+    summary = scheduler.summary()
+
+    assert list(summary) == ['start_dot_trial']
+    assert summary['start_dot_trial']['n'] == 2
+    assert summary['start_dot_trial']['mean'] == pytest.approx(0.002)
+    assert summary['start_dot_trial']['max'] == pytest.approx(0.003)
+
+
+def test_unknown_label(clock):
+
+    scheduler = TriggerScheduler(RecordingParallelPort(clock=clock, echo=False), CODES, clock=clock)
+
+    with pytest.raises(KeyError):
+        scheduler.queue('start_blob_trial')